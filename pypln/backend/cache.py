@@ -0,0 +1,125 @@
+# coding: utf-8
+#
+# Copyright 2015 NAMD-EMAP-FGV
+#
+# This file is part of PyPLN. You can get more information at: http://pypln.org/.
+#
+# PyPLN is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyPLN is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
+from datetime import datetime, timedelta
+from time import time
+
+import pymongo
+
+
+class ResultCache(object):
+    """
+    A cache stored in a MongoDB collection. Every entry keeps the time it was
+    last used (as a timestamp, since MongoDB dates only have millisecond
+    resolution), and the least recently used ones are evicted when there are
+    more than `max_entries` entries. That is only checked once every
+    `evict_every` sets, so the cache may go over the limit by that many
+    entries. If `ttl` is given, entries also expire that many seconds after
+    being set (they are removed by a MongoDB TTL index, and ignored by `get`
+    until then).
+
+    A hit costs one query and one unacknowledged update. Hits and misses are
+    counted for this process in `hits` and `misses`, and added to a stats
+    document shared by every process using the same collection (see
+    `stats`) once every `flush_stats_every` lookups.
+    """
+    STATS_ID = '_stats'
+
+    def __init__(self, collection, max_entries, ttl=None, evict_every=100,
+            flush_stats_every=100):
+        self.collection = collection
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evict_every = evict_every
+        self.flush_stats_every = flush_stats_every
+        self.hits = 0
+        self.misses = 0
+        self._unflushed = {'hits': 0, 'misses': 0}
+        self._sets_since_eviction = 0
+        self.collection.ensure_index('last_used')
+        if self.ttl:
+            self.collection.ensure_index('expires_at', expireAfterSeconds=0)
+
+    def get(self, key):
+        """
+        Returns the value stored for `key`, or `None` if there is none.
+        """
+        query = {'_id': key}
+        if self.ttl:
+            query['expires_at'] = {'$gt': datetime.utcnow()}
+        entry = self.collection.find_one(query, ['value'])
+        if entry is None:
+            self.misses += 1
+            self._count('misses')
+            return None
+        self.collection.update({'_id': key}, {'$set': {'last_used': time()}},
+                w=0)
+        self.hits += 1
+        self._count('hits')
+        return entry['value']
+
+    def set(self, key, value):
+        fields = {'value': value, 'last_used': time()}
+        if self.ttl:
+            fields['expires_at'] = datetime.utcnow() + timedelta(
+                    seconds=self.ttl)
+        self.collection.update({'_id': key}, {'$set': fields}, upsert=True)
+        self._sets_since_eviction += 1
+        if self._sets_since_eviction >= self.evict_every:
+            self._sets_since_eviction = 0
+            self._evict()
+
+    def stats(self):
+        """
+        Returns the number of hits and misses of every process using this
+        cache, and the hit rate.
+        """
+        self.flush_stats()
+        stats = self.collection.find_one({'_id': self.STATS_ID}) or {}
+        hits = stats.get('hits', 0)
+        misses = stats.get('misses', 0)
+        lookups = hits + misses
+        hit_rate = hits / float(lookups) if lookups else 0.0
+        return {'hits': hits, 'misses': misses, 'hit_rate': hit_rate}
+
+    def flush_stats(self):
+        """
+        Adds the hits and misses of this process that were not counted yet to
+        the stats document.
+        """
+        counters = {counter: count for counter, count in
+                self._unflushed.items() if count}
+        if counters:
+            self.collection.update({'_id': self.STATS_ID},
+                    {'$inc': counters}, upsert=True)
+            self._unflushed = {'hits': 0, 'misses': 0}
+
+    def _count(self, counter):
+        self._unflushed[counter] += 1
+        if sum(self._unflushed.values()) >= self.flush_stats_every:
+            self.flush_stats()
+
+    def _evict(self):
+        # The stats document has no `last_used`, so it is never evicted.
+        entries = {'last_used': {'$exists': True}}
+        excess = self.collection.find(entries).count() - self.max_entries
+        if excess > 0:
+            least_recently_used = self.collection.find(entries, ['_id']).sort(
+                    'last_used', pymongo.ASCENDING).limit(excess)
+            self.collection.remove({'_id': {'$in': [entry['_id']
+                for entry in least_recently_used]}})
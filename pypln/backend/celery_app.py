@@ -18,16 +18,38 @@
 # along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
 
 from celery import Celery
+from celery.signals import import_modules, worker_init
 from kombu import Exchange, Queue
 import config
 
-app = Celery('pypln_workers', backend='mongodb',
-        broker='amqp://', include=['pypln.backend.workers'])
+queues = [Queue(config.CELERY_QUEUE_NAME, Exchange(config.CELERY_QUEUE_NAME),
+    routing_key=config.CELERY_QUEUE_NAME)]
+routes = []
+if config.PER_WORKER_QUEUES:
+    from pypln.backend.routing import WorkerRouter, worker_queues
+    queues.extend(worker_queues())
+    routes.append(WorkerRouter())
+
+app = Celery('pypln_workers', backend='mongodb', broker='amqp://')
 app.conf.update(
     BROKER_URL=config.BROKER_URL,
     CELERY_RESULT_BACKEND=config.CELERY_RESULT_BACKEND,
-    CELERY_QUEUES=(Queue(config.CELERY_QUEUE_NAME,
-        Exchange(config.CELERY_QUEUE_NAME),
-            routing_key=config.CELERY_QUEUE_NAME),),
+    CELERY_QUEUES=tuple(queues),
+    CELERY_ROUTES=tuple(routes),
     CELERY_DEFAULT_QUEUE=config.CELERY_DEFAULT_QUEUE,
 )
+
+
+@import_modules.connect
+def import_workers(**kwargs):
+    # Only the modules of the workers enabled in this node are imported (and
+    # so registered as tasks). The import time of each one is logged.
+    from pypln.backend.workers import load_workers
+    load_workers(config.PYPLN_WORKERS)
+
+@worker_init.connect
+def warm_up_models(**kwargs):
+    # This runs in the main worker process, before the pool is started.
+    if config.WARM_UP_MODELS:
+        from pypln.backend.warmup import warm_up
+        warm_up(config.PYPLN_WORKERS)
@@ -16,8 +16,15 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
+import base64
+import hashlib
+
+import bson
 import pymongo
+from bson.son import SON
 from celery import Task
+from celery.signals import worker_process_init, worker_process_shutdown
+from celery.utils.log import get_logger
 
 # This import may look like an unused imported, but it is not.
 # When our base task class is defined, the Celery app must have already been
@@ -29,15 +36,104 @@ from celery import Task
 from pypln.backend.celery_app import app
 
 from pypln.backend import config
+from pypln.backend.cache import ResultCache
+from pypln.backend.workers import WORKER_METADATA, upstream_workers
+
+
+# The MongoClient is not fork-safe, so it must not be created when this module
+# is imported (that happens in the parent process, before Celery forks its
+# children). Each process creates its own client the first time it is needed.
+_mongo_client = None
+_result_caches = {}
+
+logger = get_logger(__name__)
+
+def get_mongo_client():
+    global _mongo_client
+    if _mongo_client is None:
+        _mongo_client = pymongo.MongoClient(host=config.MONGODB_URIS,
+                max_pool_size=config.MONGODB_MAX_POOL_SIZE,
+                connectTimeoutMS=config.MONGODB_CONNECT_TIMEOUT_MS,
+                socketTimeoutMS=config.MONGODB_SOCKET_TIMEOUT_MS,
+                waitQueueTimeoutMS=config.MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+                read_preference=getattr(pymongo.ReadPreference,
+                    config.MONGODB_READ_PREFERENCE.upper()))
+    return _mongo_client
+
+def get_database():
+    return get_mongo_client()[config.MONGODB_DBNAME]
+
+def get_document_collection():
+    return get_database()[config.MONGODB_COLLECTION]
+
+def get_cache(collection_name, max_entries, ttl=None):
+    """
+    Returns the `ResultCache` stored in the given collection for this
+    process, or `None` if `max_entries` is 0 (the cache is disabled).
+    """
+    if not max_entries:
+        return None
+    if collection_name not in _result_caches:
+        _result_caches[collection_name] = ResultCache(
+                get_database()[collection_name], max_entries, ttl)
+    return _result_caches[collection_name]
+
+def get_result_cache():
+    return get_cache(config.MONGODB_CACHE_COLLECTION,
+            config.RESULT_CACHE_MAX_ENTRIES)
+
+@worker_process_init.connect
+def connect_to_mongodb(**kwargs):
+    """
+    Drops any client inherited from the parent process and connects a new one
+    as soon as a Celery child process starts, so the first task does not pay
+    for it.
+    """
+    global _mongo_client
+    _mongo_client = None
+    _result_caches.clear()
+    get_mongo_client()
 
+@worker_process_shutdown.connect
+def flush_cache_stats(**kwargs):
+    """
+    Adds the hits and misses this process counted but did not write yet to
+    the caches' stats before it exits.
+    """
+    for cache in _result_caches.values():
+        cache.flush_stats()
 
-mongo_client = pymongo.MongoClient(host=config.MONGODB_URIS)
-database = mongo_client[config.MONGODB_DBNAME]
-document_collection = database[config.MONGODB_COLLECTION]
+def settings_values(names):
+    return {name: getattr(config, name) for name in names}
+
+def settings_digest(settings):
+    return hashlib.sha256(bson.BSON.encode(sorted_son(settings))).hexdigest()
+
+def sorted_son(value):
+    """
+    Returns the dictionary as a SON with sorted keys (also inside nested
+    dictionaries), so it is always encoded to the same BSON.
+    """
+    if isinstance(value, dict):
+        return SON((key, sorted_son(value[key])) for key in sorted(value))
+    return value
 
 class DocumentNotFound(Exception):
     pass
 
+def contents_digest(document):
+    """
+    Returns the SHA-256 hex digest of the uploaded file, which identifies
+    duplicate uploads. It is stored by the Extractor in `contents_digest`, but
+    if it's not there yet it is calculated from `contents`. Returns `None` if
+    neither of them is in the document.
+    """
+    digest = document.get('contents_digest')
+    if digest is None and 'contents' in document:
+        digest = hashlib.sha256(base64.b64decode(
+            document['contents'])).hexdigest()
+    return digest
+
 class PyPLNTask(Task):
     """
     A base class for PyPLN tasks. It is in charge of getting the document
@@ -45,22 +141,228 @@ class PyPLNTask(Task):
     by Celery), calling the `process` method, and saving this information on
     the database. It will also return the document id, so the rest of the
     pipeline has access to it.
+
+    Subclasses should list the document keys their `process` method reads in
+    `requires`, so only those fields are fetched from the database. If
+    `requires` is `None`, the whole document is fetched. The keys returned by
+    `process` should be listed in `provides`, so the pipeline knows which
+    workers depend on each other.
+
+    If the result cache is enabled (see `config.RESULT_CACHE_MAX_ENTRIES`),
+    results are cached by the digest of the uploaded file and the worker
+    `version`, so a duplicate upload gets the stored results instead of being
+    processed again. The `version` must be increased every time a change in
+    the worker changes its results, and workers whose results depend on
+    settings must list their names in `settings` (or override
+    `fingerprint_config`). The versions and settings of the workers that
+    provide the required fields are also part of the cache key; they are
+    taken from `pypln.backend.workers.WORKER_METADATA` (so their modules are
+    not imported), unless `upstream_versions` is set. Workers that have side
+    effects should set `cacheable` to `False`.
+
+    If `config.SKIP_UNCHANGED_INPUTS` is set, a fingerprint of the `version`,
+    of the settings and of the required fields is saved in `fingerprints`
+    together with the results, and running the worker again on a document
+    whose fingerprint did not change does not call `process`. Workers that
+    require the whole document are always run.
     """
+    requires = None
+    provides = None
+    version = 1
+    settings = []
+    cacheable = True
+    upstream_versions = None
 
     def run(self, document_id):
         """
         This method is called by Celery, and should not be overridden.
         It will call the `process` method with a dictionary containing all the
         document information and will update de database with results.
+
+        If a list of document ids is received instead of a single one, all
+        the documents are processed as a batch (see `run_batch`).
         """
-        document = document_collection.find_one({"_id": document_id})
+        if isinstance(document_id, (list, tuple)):
+            return self.run_batch(document_id)
+        document_collection = get_document_collection()
+        document = document_collection.find_one({"_id": document_id},
+                self._fields_to_fetch())
         if document is None:
             self.retry(exc=DocumentNotFound('Document with ObjectId("{}") '
                 'not found in database'.format(document_id)))
-        result = self.process(document)
-        document_collection.update({"_id": document_id}, {"$set": result})
+        result = self.process_document(document)
+        # An empty `$set` is rejected by MongoDB.
+        if result:
+            document_collection.update({"_id": document_id}, {"$set": result})
         return document_id
 
+    def run_batch(self, document_ids):
+        """
+        Process many documents fetching all of them with a single query and
+        saving all the results with a single unordered bulk write. This avoids
+        paying a database round trip per document when they are small.
+
+        It returns the list of document ids, so the next task in the pipeline
+        will also process them as a batch. Documents that are not found are
+        logged and left out of it, so they don't keep the others from being
+        processed; the task is only retried if none of them is found.
+        """
+        document_ids = list(document_ids)
+        document_collection = get_document_collection()
+        documents = {document['_id']: document for document in
+                document_collection.find({"_id": {"$in": document_ids}},
+                    self._fields_to_fetch())}
+        missing_ids = [document_id for document_id in document_ids
+                if document_id not in documents]
+        if missing_ids:
+            error = DocumentNotFound('Documents with ObjectIds {} not found '
+                'in database'.format(', '.join('"{}"'.format(document_id)
+                    for document_id in missing_ids)))
+            if not documents:
+                self.retry(exc=error)
+            logger.warning('{}: {}'.format(self.name, error))
+
+        bulk = document_collection.initialize_unordered_bulk_op()
+        has_updates = False
+        for document_id, document in documents.items():
+            result = self.process_document(document)
+            # An empty `$set` is rejected by MongoDB, and would make the whole
+            # bulk operation fail.
+            if result:
+                bulk.find({"_id": document_id}).update_one({"$set": result})
+                has_updates = True
+        if has_updates:
+            bulk.execute()
+        return [document_id for document_id in document_ids
+                if document_id in documents]
+
+    def get_result_cache(self):
+        """
+        Returns the cache for the results of this worker, or `None` if it is
+        disabled.
+        """
+        return get_result_cache()
+
+    def should_cache(self, result):
+        """
+        Returns whether the result of `process` may be cached. Workers can
+        override it to keep failures out of the cache.
+        """
+        return True
+
+    def from_cache(self, result):
+        """
+        Returns the results to save when they are taken from the cache.
+        Workers whose results describe the work done to get them (and not
+        only its output) should override it.
+        """
+        return result
+
+    def fingerprint_config(self):
+        """
+        Returns a dictionary with the settings that change the results of
+        this worker, which are part of its fingerprint and of its cache key.
+        By default, the values of the settings named in `settings`.
+        """
+        return settings_values(self.settings)
+
+    def _config_digest(self):
+        return settings_digest(self.fingerprint_config())
+
+    def get_upstream_versions(self):
+        """
+        Returns the version and settings of every worker whose results this
+        one uses (directly or not), by name. Unless `upstream_versions` is
+        set, they are taken from `WORKER_METADATA`.
+        """
+        if self.upstream_versions is not None:
+            return self.upstream_versions
+        upstream = upstream_workers(self.requires)
+        upstream.discard(self.__class__.__name__)
+        return {name: {'version': WORKER_METADATA[name].version,
+            'config': settings_digest(settings_values(
+                WORKER_METADATA[name].settings))}
+            for name in upstream}
+
+    def _cache_namespace(self):
+        # Results are cached by the digest of the upload, so they must also
+        # be keyed by everything that changes the fields this worker reads:
+        # its own settings, and the versions and settings of the workers
+        # that produced them.
+        namespace = sorted_son({'config': self.fingerprint_config(),
+            'upstream': self.get_upstream_versions()})
+        return hashlib.sha256(bson.BSON.encode(namespace)).hexdigest()
+
+    def _uses_cache(self):
+        return self.cacheable and self.get_result_cache() is not None
+
+    def _fingerprint_field(self):
+        return 'fingerprints.{}'.format(self.__class__.__name__)
+
+    def _fields_to_fetch(self):
+        if self.requires is None:
+            return None
+        fields = list(self.requires)
+        # Documents whose upload is in the upload store only have its digest
+        # instead of `contents`.
+        if self._uses_cache() or 'contents' in fields:
+            fields.append('contents_digest')
+        if config.SKIP_UNCHANGED_INPUTS:
+            fields.append(self._fingerprint_field())
+        return fields
+
+    def fingerprint(self, document):
+        """
+        Returns a digest of the worker version and settings and of the
+        required fields of the document, or `None` if the worker requires the
+        whole document. The upload is represented by its digest.
+        """
+        if self.requires is None:
+            return None
+        inputs = SON([('version', self.version),
+            ('config', self._config_digest())] + [(field,
+            contents_digest(document) if field == 'contents' else
+            document.get(field)) for field in sorted(self.requires)])
+        return hashlib.sha256(bson.BSON.encode(inputs)).hexdigest()
+
+    def process_document(self, document):
+        """
+        Returns the results of `process` for the document, taking them from
+        the result cache when possible, and its fingerprint. If the inputs
+        did not change since the last run, returns an empty dictionary.
+        """
+        fingerprint = None
+        if config.SKIP_UNCHANGED_INPUTS:
+            fingerprint = self.fingerprint(document)
+            last_fingerprint = document.get('fingerprints', {}).get(
+                    self.__class__.__name__)
+            if fingerprint is not None and fingerprint == last_fingerprint:
+                return {}
+
+        result = self._cached_process(document)
+        if fingerprint is not None:
+            result[self._fingerprint_field()] = fingerprint
+        return result
+
+    def _cached_process(self, document):
+        if not self._uses_cache():
+            return self.process(document)
+        digest = contents_digest(document)
+        if digest is None:
+            return self.process(document)
+        # Keep the digest, so `process` does not need to calculate it again.
+        document['contents_digest'] = digest
+        cache_key = '{}:{}:{}:{}'.format(self.name, self.version,
+                self._cache_namespace(), digest)
+        result_cache = self.get_result_cache()
+        result = result_cache.get(cache_key)
+        if result is not None:
+            return self.from_cache(result)
+        result = self.process(document)
+        if self.should_cache(result):
+            result_cache.set(cache_key, result)
+        return result
+
     def process(self, document):
         """
         This process should be implemented by subclasses. It is responsible for
@@ -1,4 +1,5 @@
 import os
+from multiprocessing import cpu_count
 
 from decouple import config, Csv
 
@@ -26,11 +27,68 @@ def parse_url(url):
 def split_uris(uri):
     return uri.split(';')
 
+def int_or_none(value):
+    if value in ('', None):
+        return None
+    return int(value)
+
+def parse_pairs(value):
+    """
+    Parses a comma separated list of `key:value` pairs into a dictionary.
+    """
+    return dict(pair.split(':', 1) for pair in Csv()(value))
+
+def parse_int_pairs(value):
+    return {key: int(number) for key, number in parse_pairs(value).items()}
+
 
 MONGODB_URIS = config('MONGODB_URIS', default='mongodb://localhost:27017',
         cast=split_uris)
 MONGODB_DBNAME = config('MONGODB_DBNAME', default='pypln')
 MONGODB_COLLECTION =  config('MONGODB_COLLECTION', default='analysis')
+# Each worker process has its own client, with its own connection pool.
+MONGODB_MAX_POOL_SIZE = config('MONGODB_MAX_POOL_SIZE', default=10, cast=int)
+# Timeouts are in milliseconds. An empty value means no timeout.
+MONGODB_CONNECT_TIMEOUT_MS = config('MONGODB_CONNECT_TIMEOUT_MS',
+        default='20000', cast=int_or_none)
+MONGODB_SOCKET_TIMEOUT_MS = config('MONGODB_SOCKET_TIMEOUT_MS', default='',
+        cast=int_or_none)
+MONGODB_WAIT_QUEUE_TIMEOUT_MS = config('MONGODB_WAIT_QUEUE_TIMEOUT_MS',
+        default='', cast=int_or_none)
+# One of primary, primary_preferred, secondary, secondary_preferred or nearest.
+MONGODB_READ_PREFERENCE = config('MONGODB_READ_PREFERENCE',
+        default='primary')
+# Raw uploads are kept in this GridFS collection, identified by their SHA-256
+# digest (see `pypln.backend.uploads`).
+MONGODB_UPLOADS_COLLECTION = config('MONGODB_UPLOADS_COLLECTION',
+        default='files')
+# GridFS collection for the texts extracted from very large uploads (see
+# `STREAMING_EXTRACTION_MIN_SIZE`).
+MONGODB_TEXTS_COLLECTION = config('MONGODB_TEXTS_COLLECTION',
+        default='texts')
+MONGODB_CACHE_COLLECTION = config('MONGODB_CACHE_COLLECTION',
+        default='result_cache')
+MONGODB_EXTRACTOR_CACHE_COLLECTION = config(
+        'MONGODB_EXTRACTOR_CACHE_COLLECTION', default='extractor_cache')
+
+# Maximum number of worker results kept in the cache used to avoid
+# reprocessing duplicate uploads. The cache is disabled if this is 0.
+RESULT_CACHE_MAX_ENTRIES = config('RESULT_CACHE_MAX_ENTRIES', default=0,
+        cast=int)
+
+# The Extractor results have a cache of their own, since duplicate uploads
+# are common and extraction is the most expensive step. Entries expire after
+# EXTRACTOR_CACHE_TTL seconds (0 means never). If this cache is disabled, the
+# Extractor uses the cache of the other workers.
+EXTRACTOR_CACHE_MAX_ENTRIES = config('EXTRACTOR_CACHE_MAX_ENTRIES',
+        default=0, cast=int)
+EXTRACTOR_CACHE_TTL = config('EXTRACTOR_CACHE_TTL', default=30 * 24 * 3600,
+        cast=int)
+
+# Skip workers whose inputs (and code version and settings) did not change
+# since they last processed the document.
+SKIP_UNCHANGED_INPUTS = config('SKIP_UNCHANGED_INPUTS', default=False,
+        cast=bool)
 
 ELASTICSEARCH_CONFIG = {
     'hosts': config('ELASTICSEARCH_HOSTS',
@@ -48,3 +106,154 @@ CELERY_RESULT_BACKEND = MONGODB_URIS[0]
 
 CELERY_DEFAULT_QUEUE = "pypln"
 CELERY_QUEUE_NAME = "pypln"
+
+# Names of the workers (see `pypln.backend.workers.WORKER_MODULES`) this
+# node runs. Only their modules are imported. If empty, all the workers
+# exported by `pypln.backend.workers` are run.
+PYPLN_WORKERS = config('PYPLN_WORKERS', default='', cast=Csv())
+
+# Load NLP models in the main worker process before the pool is forked, so
+# child processes share them.
+WARM_UP_MODELS = config('WARM_UP_MODELS', default=True, cast=bool)
+
+# Put each worker on its own queue (named after the worker, like
+# `pypln.Extractor`), so slow workers don't hold the slots of fast ones and
+# each kind of worker can be scaled separately.
+PER_WORKER_QUEUES = config('PER_WORKER_QUEUES', default=False, cast=bool)
+
+# The resource each worker mostly uses. Nodes can be dedicated to the queues
+# of one resource class and run it with the suggested concurrency (see
+# `pypln.backend.routing`). Can be overridden with `Worker:class` pairs, like
+# `WORKER_RESOURCE_CLASSES=Tokenizer:cpu-light,WordCloud:cpu-light`.
+WORKER_RESOURCE_CLASSES = {
+    'Extractor': 'subprocess',
+    'Tokenizer': 'cpu-heavy',
+    'FreqDist': 'cpu-light',
+    'POS': 'cpu-heavy',
+    'Statistics': 'cpu-light',
+    'Bigrams': 'cpu-heavy',
+    'Trigrams': 'cpu-heavy',
+    'PalavrasRaw': 'subprocess',
+    'Lemmatizer': 'cpu-light',
+    'NounPhrase': 'subprocess',
+    'SemanticTagger': 'cpu-light',
+    'SpellingChecker': 'cpu-heavy',
+    'WordCloud': 'cpu-heavy',
+    'ElasticIndexer': 'io-bound',
+}
+WORKER_RESOURCE_CLASSES.update(config('WORKER_RESOURCE_CLASSES', default='',
+    cast=parse_pairs))
+
+RESOURCE_CLASS_CONCURRENCY = {
+    'cpu-heavy': config('CPU_HEAVY_CONCURRENCY', default=cpu_count(),
+        cast=int),
+    'cpu-light': config('CPU_LIGHT_CONCURRENCY', default=cpu_count(),
+        cast=int),
+    'subprocess': config('SUBPROCESS_CONCURRENCY', default=cpu_count(),
+        cast=int),
+    'io-bound': config('IO_BOUND_CONCURRENCY', default=4 * cpu_count(),
+        cast=int),
+}
+
+# PDFs are converted in ranges of this many pages, converted in parallel
+# (up to `PDF_MAX_PARALLEL_CHUNKS` at a time) so a long PDF doesn't keep a
+# single core busy for minutes. Set it to 0 to convert the whole PDF at once.
+# Every Extractor task runs its own chunks, so a node may run
+# SUBPROCESS_CONCURRENCY * PDF_MAX_PARALLEL_CHUNKS `pdftohtml` processes at
+# once, each one allowed EXTRACTOR_MEMORY_LIMIT megabytes. By default the
+# cores are divided by the concurrency, so that product is the number of
+# cores.
+PDF_PAGES_PER_CHUNK = config('PDF_PAGES_PER_CHUNK', default=50, cast=int)
+PDF_MAX_PARALLEL_CHUNKS = config('PDF_MAX_PARALLEL_CHUNKS',
+        default=max(1, cpu_count() //
+            max(1, RESOURCE_CLASS_CONCURRENCY['subprocess'])), cast=int)
+
+# Where the extractor creates the scratch directory of each task (removed
+# when it finishes). Defaults to a memory backed filesystem, if there is one,
+# to avoid disk I/O; otherwise the system temporary directory is used.
+EXTRACTOR_SCRATCH_DIR = config('EXTRACTOR_SCRATCH_DIR',
+        default='/dev/shm' if os.path.isdir('/dev/shm') else '')
+
+# The Extractor detects the mimetype and the encoding from this many bytes at
+# the start of the upload, and the language from a sample of this many
+# characters of the text. The whole upload (or text) is only examined when
+# the detection from the sample is not reliable.
+EXTRACTOR_SNIFF_SIZE = config('EXTRACTOR_SNIFF_SIZE', default=64 * 1024,
+        cast=int)
+LANGUAGE_SAMPLE_SIZE = config('LANGUAGE_SAMPLE_SIZE', default=64 * 1024,
+        cast=int)
+
+# Texts with at least this many characters are split at paragraph
+# boundaries, in chunks of about TOKENIZER_CHUNK_SIZE characters, which are
+# tokenized by a pool of TOKENIZER_PROCESSES processes (a paragraph break
+# always ends a sentence then). The pool can't be started by the children
+# of Celery's prefork pool, which are daemonic, so only workers run with
+# `-P solo` or `-P threads` (like a node dedicated to the Tokenizer queue,
+# see PER_WORKER_QUEUES) use it; elsewhere the text is tokenized as a whole.
+# 0 disables it.
+TOKENIZER_PARALLEL_MIN_SIZE = config('TOKENIZER_PARALLEL_MIN_SIZE',
+        default=1024 * 1024, cast=int)
+TOKENIZER_CHUNK_SIZE = config('TOKENIZER_CHUNK_SIZE', default=256 * 1024,
+        cast=int)
+TOKENIZER_PROCESSES = config('TOKENIZER_PROCESSES', default=cpu_count(),
+        cast=int)
+
+# Store the tokens and sentences of each document as a vocabulary and packed
+# token ids instead of lists of strings, which takes about half the space
+# (see `pypln.backend.tokens`).
+COMPACT_TOKENS = config('COMPACT_TOKENS', default=False, cast=bool)
+
+# FreqDist only keeps the FREQDIST_TOP_K most frequent tokens (0 keeps all
+# of them) among the ones that appear at least FREQDIST_MIN_COUNT times.
+# Statistics and WordCloud use this distribution, so the cutoffs change their
+# results too.
+FREQDIST_TOP_K = config('FREQDIST_TOP_K', default=0, cast=int)
+FREQDIST_MIN_COUNT = config('FREQDIST_MIN_COUNT', default=1, cast=int)
+
+# Plain text and HTML uploads of at least this many bytes are extracted in
+# chunks of STREAMING_CHUNK_SIZE bytes, so the memory used does not depend on
+# their size, and their text is written to GridFS instead of the document
+# (see `pypln.backend.texts`). 0 disables it. Smaller texts are stored in the
+# document (and in the result cache), which MongoDB limits to 16MB; the text
+# of an ISO-8859-1 upload takes up to twice its size in UTF-8, so this must
+# stay well below 8MB.
+STREAMING_EXTRACTION_MIN_SIZE = config('STREAMING_EXTRACTION_MIN_SIZE',
+        default=4 * 1024 * 1024, cast=int)
+STREAMING_CHUNK_SIZE = config('STREAMING_CHUNK_SIZE', default=1024 * 1024,
+        cast=int)
+
+# Limits for the programs run by the extractor (like `pdftohtml`), so a
+# malformed PDF can't hold a worker forever: wall-clock and CPU time (in
+# seconds), memory and size of each output (in megabytes). A document that
+# hits one of them gets an `extraction_error` and no text. 0 disables the
+# limit.
+EXTRACTOR_TIMEOUT = config('EXTRACTOR_TIMEOUT', default=600, cast=int)
+EXTRACTOR_CPU_TIME = config('EXTRACTOR_CPU_TIME', default=300, cast=int)
+EXTRACTOR_MEMORY_LIMIT = config('EXTRACTOR_MEMORY_LIMIT', default=2048,
+        cast=int)
+EXTRACTOR_MAX_OUTPUT = config('EXTRACTOR_MAX_OUTPUT', default=512, cast=int)
+
+# Names of the backends the extractor uses (see
+# `pypln.backend.workers.extractor.ExtractorBackend`), in the order they are
+# tried for each MIME type. `pypdf2` extracts the text of PDFs in the worker
+# process, which is much faster than running `pdftohtml` for small ones; it
+# needs PyPDF2 and is only used if listed here (like
+# `EXTRACTOR_BACKENDS=plain-text,html,pypdf2,pdftohtml`). Uploads a backend
+# can't handle are passed to the next one.
+EXTRACTOR_BACKENDS = config('EXTRACTOR_BACKENDS',
+        default='plain-text,html,pdftohtml', cast=Csv())
+# Limits of each backend, which can be overridden with `backend:value` pairs
+# (like `EXTRACTOR_BACKEND_TIMEOUTS=pypdf2:10`). 0 or a missing backend means
+# no limit. The timeout (in seconds) of backends that run programs applies to
+# each program they run; uploads bigger than the maximum size (in bytes) are
+# passed to the next backend; concurrency is the number of uploads a backend
+# extracts at the same time in a worker process (which only matters when
+# tasks run in threads).
+EXTRACTOR_BACKEND_TIMEOUTS = {'pypdf2': 30, 'pdftohtml': EXTRACTOR_TIMEOUT}
+EXTRACTOR_BACKEND_TIMEOUTS.update(config('EXTRACTOR_BACKEND_TIMEOUTS',
+    default='', cast=parse_int_pairs))
+EXTRACTOR_BACKEND_MAX_SIZES = {'pypdf2': 1024 * 1024}
+EXTRACTOR_BACKEND_MAX_SIZES.update(config('EXTRACTOR_BACKEND_MAX_SIZES',
+    default='', cast=parse_int_pairs))
+EXTRACTOR_BACKEND_CONCURRENCY = config('EXTRACTOR_BACKEND_CONCURRENCY',
+        default='', cast=parse_int_pairs)
@@ -0,0 +1,55 @@
+# coding: utf-8
+#
+# Copyright 2015 NAMD-EMAP-FGV
+#
+# This file is part of PyPLN. You can get more information at: http://pypln.org/.
+#
+# PyPLN is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyPLN is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Packs lists of non-negative integers (like the character spans of tokens)
+as little-endian 32-bit integers in a BSON binary value. A list of spans
+stored like this takes 8 bytes per span, while a BSON array of pairs takes
+more than 30.
+"""
+import sys
+from array import array
+
+from bson.binary import Binary
+
+
+# 'I' is 32 bits wide in every platform we run on.
+TYPECODE = 'I'
+
+def pack_ints(values):
+    packed = array(TYPECODE, values)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return Binary(packed.tostring())
+
+def unpack_ints(data):
+    unpacked = array(TYPECODE)
+    unpacked.fromstring(data)
+    if sys.byteorder == 'big':
+        unpacked.byteswap()
+    return unpacked.tolist()
+
+def pack_spans(spans):
+    """
+    Packs a list of `(start, end)` pairs.
+    """
+    return pack_ints(value for span in spans for value in span)
+
+def unpack_spans(data):
+    values = unpack_ints(data)
+    return zip(values[::2], values[1::2])
@@ -0,0 +1,210 @@
+# coding: utf-8
+#
+# Copyright 2015 NAMD-EMAP-FGV
+#
+# This file is part of PyPLN. You can get more information at: http://pypln.org/.
+#
+# PyPLN is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyPLN is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
+from celery import Task, group
+from celery.utils.log import get_logger
+
+from pypln.backend import workers as pypln_workers
+from pypln.backend.celery_task import (DocumentNotFound, PyPLNTask,
+        get_document_collection)
+
+
+logger = get_logger(__name__)
+
+
+class CyclicDependency(Exception):
+    pass
+
+
+class FusedPipeline(PyPLNTask):
+    """
+    Runs a sequence of workers inside a single task. The document is fetched
+    once, the `process` method of each worker receives it already updated (in
+    memory) with the results of the previous ones, and all results are saved
+    at the end. This avoids a database round trip between stages.
+
+    Subclasses must list the worker classes in `stages`, in the order they
+    should run. If `checkpoint_every` is set, the results accumulated so far
+    are saved every time that many stages finish, so a failure late in the
+    pipeline does not throw away all the work done.
+
+    When the result cache is enabled, the results of the whole pipeline are
+    cached together (unless checkpoints are used, since then `process` only
+    returns the results of the stages after the last checkpoint).
+    """
+    abstract = True
+    stages = []
+    checkpoint_every = None
+
+    @property
+    def version(self):
+        return '.'.join(str(stage.version) for stage in self.stages)
+
+    def fingerprint_config(self):
+        return {stage.name: self.app.tasks[stage.name].fingerprint_config()
+                for stage in self.stages}
+
+    @property
+    def cacheable(self):
+        return not self.checkpoint_every
+
+    @property
+    def requires(self):
+        fields = set()
+        provided = set()
+        for stage in self.stages:
+            if stage.requires is None:
+                return None
+            fields.update(set(stage.requires) - provided)
+            provided.update(stage.provides or [])
+        return sorted(fields)
+
+    def process(self, document):
+        result = {}
+        for index, stage in enumerate(self.stages, start=1):
+            stage_result = self.app.tasks[stage.name].process(document)
+            document.update(stage_result)
+            result.update(stage_result)
+            if result and self.checkpoint_every and \
+                    index % self.checkpoint_every == 0:
+                get_document_collection().update({"_id": document["_id"]},
+                        {"$set": result})
+                result = {}
+        return result
+
+
+class DependencyGraph(object):
+    """
+    Dependencies between workers, built from their `requires` and `provides`
+    attributes: a worker depends on every other worker that provides a field
+    it requires. A worker that requires the whole document (`requires` is
+    `None`) depends on all workers that don't.
+
+    `workers` may be worker classes or task instances and defaults to the
+    workers exported by `pypln.backend.workers`.
+    """
+
+    def __init__(self, workers=None):
+        if workers is None:
+            workers = [getattr(pypln_workers, name)
+                    for name in pypln_workers.__all__]
+        self.dependencies = {}
+        for worker in workers:
+            if worker.requires is None:
+                dependencies = [other for other in workers
+                        if other.requires is not None]
+            else:
+                dependencies = [other for other in workers
+                        if other is not worker and
+                        set(other.provides or []) & set(worker.requires)]
+            self.dependencies[worker.name] = set(other.name
+                    for other in dependencies)
+        self._check_cycles()
+
+    def _check_cycles(self):
+        done = set()
+        remaining = set(self.dependencies)
+        while remaining:
+            ready = self.ready(done) & remaining
+            if not ready:
+                raise CyclicDependency('The following workers depend on each '
+                        'other: {}'.format(', '.join(sorted(remaining))))
+            done.update(ready)
+            remaining.difference_update(ready)
+
+    def ready(self, completed):
+        """
+        Returns the names of the workers that did not run yet but have all
+        their dependencies in `completed`.
+        """
+        completed = set(completed)
+        return set(name for name, dependencies in self.dependencies.items()
+                if name not in completed and dependencies <= completed)
+
+
+class DependencyPipeline(Task):
+    """
+    Runs the workers named in `worker_names` on a document following their
+    dependency graph (see `DependencyGraph`). Every worker is dispatched as
+    soon as all the workers it depends on have finished, and the ones that
+    become ready at the same time are dispatched together as a Celery group.
+
+    It is called once to start the pipeline and then again, as a callback,
+    every time one of the workers finishes (with that worker's name in
+    `completed_worker`). The names of the finished and dispatched workers
+    are kept in the document, so concurrent callbacks never dispatch the same
+    worker twice. Workers that fail are recorded in `pipeline_failed` (see
+    `PipelineWorkerFailed`), and the ones that depend on them never run.
+    """
+
+    def run(self, document_id, worker_names, completed_worker=None):
+        graph = DependencyGraph([self.app.tasks[name]
+            for name in worker_names])
+        document_collection = get_document_collection()
+        if completed_worker is None:
+            document_collection.update({"_id": document_id},
+                    {"$unset": {"pipeline_completed": 1,
+                        "pipeline_dispatched": 1, "pipeline_failed": 1}})
+            completed = []
+        else:
+            document = document_collection.find_and_modify(
+                    {"_id": document_id},
+                    {"$addToSet": {"pipeline_completed": completed_worker}},
+                    fields=["pipeline_completed"], new=True)
+            if document is None:
+                self.retry(exc=DocumentNotFound('Document with ObjectId("{}") '
+                    'not found in database'.format(document_id)))
+            completed = document["pipeline_completed"]
+
+        signatures = []
+        for name in sorted(graph.ready(completed)):
+            claimed = document_collection.update({"_id": document_id,
+                "pipeline_dispatched": {"$ne": name}},
+                {"$addToSet": {"pipeline_dispatched": name}})
+            if claimed['n']:
+                callback = self.si(document_id, worker_names, name)
+                errback = PipelineWorkerFailed().s(document_id, name)
+                signatures.append(self.app.tasks[name].si(document_id).set(
+                    link=callback, link_error=errback))
+        if signatures:
+            group(signatures).apply_async()
+        return document_id
+
+
+class PipelineWorkerFailed(Task):
+    """
+    Called by Celery when a worker dispatched by `DependencyPipeline` fails
+    (with the id of the failed task). Logs the failure and adds the worker
+    name to the `pipeline_failed` list of the document.
+    """
+
+    def run(self, task_id, document_id, worker_name):
+        logger.error('{} failed on document {} (task {})'.format(worker_name,
+            document_id, task_id))
+        get_document_collection().update({"_id": document_id},
+                {"$addToSet": {"pipeline_failed": worker_name}})
+        return document_id
+
+
+def run_pipeline(document_id, workers=None):
+    """
+    Starts a `DependencyPipeline` for the document. `workers` defaults to
+    the workers exported by `pypln.backend.workers`.
+    """
+    graph = DependencyGraph(workers)
+    return DependencyPipeline().delay(document_id, sorted(graph.dependencies))
@@ -0,0 +1,88 @@
+# coding: utf-8
+#
+# Copyright 2015 NAMD-EMAP-FGV
+#
+# This file is part of PyPLN. You can get more information at: http://pypln.org/.
+#
+# PyPLN is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyPLN is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Routing of each worker to its own queue, grouped in resource classes.
+
+The queues are only declared (and the tasks routed to them) when
+`PER_WORKER_QUEUES` is set. Then each node can consume the queues of one
+resource class with a suitable concurrency; run this module to get the
+suggested command line for each class:
+
+    python -m pypln.backend.routing
+"""
+from kombu import Exchange, Queue
+
+from pypln.backend import config
+
+
+WORKERS_PACKAGE = 'pypln.backend.workers.'
+
+def queue_name(worker_name):
+    return '{}.{}'.format(config.CELERY_QUEUE_NAME, worker_name)
+
+def worker_queues():
+    """
+    Returns one queue for each worker with a resource class, bound to the
+    same exchange as the default queue.
+    """
+    exchange = Exchange(config.CELERY_QUEUE_NAME)
+    return [Queue(queue_name(worker_name), exchange,
+        routing_key=queue_name(worker_name))
+        for worker_name in sorted(config.WORKER_RESOURCE_CLASSES)]
+
+def queues_for_resource_class(resource_class):
+    return [queue_name(worker_name) for worker_name, worker_class in
+            sorted(config.WORKER_RESOURCE_CLASSES.items())
+            if worker_class == resource_class]
+
+def suggested_concurrency(resource_class):
+    return config.RESOURCE_CLASS_CONCURRENCY[resource_class]
+
+def worker_command(resource_class):
+    """
+    Returns the command line to start a node that runs the workers of the
+    given resource class.
+    """
+    return 'celery worker --app=pypln.backend.celery_app:app -Q {} ' \
+            '--concurrency={}'.format(
+                    ','.join(queues_for_resource_class(resource_class)),
+                    suggested_concurrency(resource_class))
+
+
+class WorkerRouter(object):
+    """
+    Sends each worker task to the queue of that worker. Other tasks (like
+    the pipelines) are left to the default queue.
+    """
+
+    def route_for_task(self, task, args=None, kwargs=None):
+        if not task.startswith(WORKERS_PACKAGE):
+            return None
+        worker_name = task.rsplit('.', 1)[-1]
+        if worker_name not in config.WORKER_RESOURCE_CLASSES:
+            return None
+        return {'queue': queue_name(worker_name),
+                'routing_key': queue_name(worker_name)}
+
+
+if __name__ == '__main__':
+    for resource_class in sorted(set(
+            config.WORKER_RESOURCE_CLASSES.values())):
+        print('# {}'.format(resource_class))
+        print(worker_command(resource_class))
@@ -0,0 +1,229 @@
+# coding: utf-8
+#
+# Copyright 2015 NAMD-EMAP-FGV
+#
+# This file is part of PyPLN. You can get more information at: http://pypln.org/.
+#
+# PyPLN is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyPLN is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Runs external programs with limits on wall-clock time, CPU time, memory and
+output size, so a malformed input can't make them hold a worker forever.
+Code that runs in the worker process itself can only get a wall-clock limit
+(see `time_limit`).
+"""
+import os
+import signal
+import sys
+from contextlib import contextmanager
+from subprocess import Popen, PIPE
+from threading import Lock, Thread, Timer, current_thread, _MainThread
+
+
+READ_SIZE = 64 * 1024
+
+# Sets the limits in the child process and then runs the program. A
+# `preexec_fn` would do the same, but it runs after `fork` in a copy of a
+# process that may have other threads (like the ones `run` starts), and a
+# lock held by one of them stays locked forever in the child. The arguments
+# are the CPU time, memory and file size limits (0 for none) and the
+# program to run.
+LIMITS_SHIM = """
+import os, resource, signal, sys
+# A process group of its own, so the processes it starts are stopped with it.
+os.setsid()
+# Python ignores these signals, and so would the program.
+signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+signal.signal(signal.SIGXFSZ, signal.SIG_DFL)
+cpu_time, memory, max_output = [int(limit) for limit in sys.argv[1:4]]
+if cpu_time:
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_time, cpu_time + 1))
+if memory:
+    resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+if max_output:
+    resource.setrlimit(resource.RLIMIT_FSIZE, (max_output, max_output))
+try:
+    os.execvp(sys.argv[4], sys.argv[4:])
+except OSError as error:
+    sys.stderr.write('{}: {}\\n'.format(sys.argv[4], error))
+    os._exit(127)
+"""
+
+class LimitExceeded(Exception):
+    """
+    Raised when a program is stopped by one of its limits. `reason` is one of
+    'timeout', 'cpu_time', 'file_size', 'output_size' or 'crashed' (killed by
+    a signal, which is how most programs fail when they run out of memory).
+    Callers may also raise it with reasons of their own, like 'input_size'.
+    """
+
+    def __init__(self, command, reason, detail=''):
+        super(LimitExceeded, self).__init__('{} stopped ({}){}'.format(
+            command, reason, ': ' + detail if detail else ''))
+        self.command = command
+        self.reason = reason
+        self.detail = detail
+
+    def as_marker(self):
+        """
+        Returns the failure as a dictionary, to be stored in the document.
+        """
+        return {'command': self.command, 'reason': self.reason,
+                'detail': self.detail}
+
+
+def kill(process):
+    """
+    Kills the process and every process it started, unless it already
+    exited.
+    """
+    if process.returncode is None:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+
+class ProcessRegistry(object):
+    """
+    Keeps the processes started by `run` (pass `add` as its `on_start`), so
+    the ones still running can be stopped at once, e.g. when one of several
+    programs running in parallel fails. Processes added after `kill_all` are
+    killed as soon as they start.
+    """
+
+    def __init__(self):
+        self.processes = []
+        self.killed = False
+        self.lock = Lock()
+
+    def add(self, process):
+        with self.lock:
+            self.processes.append(process)
+            killed = self.killed
+        if killed:
+            kill(process)
+
+    def kill_all(self):
+        with self.lock:
+            self.killed = True
+            processes = list(self.processes)
+        for process in processes:
+            kill(process)
+
+
+def run(args, input_data='', timeout=None, cpu_time=None, memory=None,
+        max_output=None, on_start=None):
+    """
+    Runs the program in `args` with `input_data` in its standard input and
+    returns its standard output and error. `timeout` and `cpu_time` are in
+    seconds and `memory` and `max_output` in bytes; `max_output` applies to
+    each of the outputs and to every file the program writes. `on_start`, if
+    given, is called with the `Popen` object as soon as the program starts.
+    If the program can't be run, it exits with status 127 and the error in
+    its standard error.
+    Raises `LimitExceeded` if the program is stopped by one of the limits.
+    """
+    command = args[0]
+    limits = [str(limit or 0) for limit in (cpu_time, memory, max_output)]
+    process = Popen([sys.executable, '-S', '-E', '-c', LIMITS_SHIM] + limits +
+            list(args), stdin=PIPE, stdout=PIPE, stderr=PIPE, close_fds=True)
+    if on_start is not None:
+        on_start(process)
+    stopped_by = []
+    lock = Lock()
+
+    def stop(reason):
+        with lock:
+            if stopped_by or process.returncode is not None:
+                return
+            stopped_by.append(reason)
+            kill(process)
+
+    outputs = {}
+
+    def read(name, stream):
+        chunks = []
+        size = 0
+        while True:
+            chunk = stream.read(READ_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if max_output and size > max_output:
+                stop('output_size')
+                break
+            chunks.append(chunk)
+        outputs[name] = ''.join(chunks)
+
+    def write():
+        try:
+            process.stdin.write(input_data)
+            process.stdin.close()
+        except IOError:
+            # The program exited (or was stopped) without reading everything.
+            pass
+
+    threads = [Thread(target=write),
+               Thread(target=read, args=('stdout', process.stdout)),
+               Thread(target=read, args=('stderr', process.stderr))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    timer = None
+    if timeout:
+        timer = Timer(timeout, stop, ['timeout'])
+        timer.daemon = True
+        timer.start()
+    try:
+        for thread in threads:
+            thread.join()
+        process.wait()
+    finally:
+        if timer is not None:
+            timer.cancel()
+
+    if stopped_by:
+        raise LimitExceeded(command, stopped_by[0])
+    elif process.returncode == -signal.SIGXCPU:
+        raise LimitExceeded(command, 'cpu_time')
+    elif process.returncode == -signal.SIGXFSZ:
+        raise LimitExceeded(command, 'file_size')
+    elif process.returncode < 0:
+        raise LimitExceeded(command, 'crashed', 'killed by signal {}'.format(
+            -process.returncode))
+    return outputs['stdout'], outputs['stderr']
+
+
+@contextmanager
+def time_limit(seconds, command):
+    """
+    Raises `LimitExceeded` (with `command` and the 'timeout' reason) inside
+    the block if it runs for more than `seconds`. It uses SIGALRM, so the
+    limit only applies in the main thread, which is where the tasks of
+    Celery's prefork pool run; elsewhere the block runs without a limit.
+    """
+    if not seconds or not isinstance(current_thread(), _MainThread):
+        yield
+        return
+
+    def stop(signum, frame):
+        raise LimitExceeded(command, 'timeout')
+
+    previous_handler = signal.signal(signal.SIGALRM, stop)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
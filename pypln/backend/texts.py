@@ -0,0 +1,57 @@
+# coding: utf-8
+#
+# Copyright 2015 NAMD-EMAP-FGV
+#
+# This file is part of PyPLN. You can get more information at: http://pypln.org/.
+#
+# PyPLN is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyPLN is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
+"""
+The text of very large uploads is not stored in the analysis document (see
+`config.STREAMING_EXTRACTION_MIN_SIZE`) but in GridFS, and the document
+keeps its id in `text_file_id`. Workers should get the text with
+`document_text`, and require both `text` and `text_file_id`.
+
+The text of a document that is extracted again is stored in a new file, and
+the previous one is left in GridFS, since a duplicate upload may have gotten
+it from the cache; `scripts/delete_unused_texts.py` deletes the ones nothing
+refers to anymore.
+"""
+import gridfs
+
+from pypln.backend import config
+from pypln.backend.celery_task import get_database
+
+
+def get_text_store():
+    return gridfs.GridFS(get_database(), config.MONGODB_TEXTS_COLLECTION)
+
+def new_text_file(**metadata):
+    """
+    Returns a new GridFS file to write a text to (as unicode).
+    """
+    return get_text_store().new_file(encoding='utf-8',
+            contentType='text/plain; charset=utf-8', **metadata)
+
+def delete_text_file(file_id):
+    get_text_store().delete(file_id)
+
+def document_text(document):
+    file_id = document.get('text_file_id')
+    if file_id is None:
+        return document['text']
+    text_file = get_text_store().get(file_id)
+    try:
+        return text_file.read().decode('utf-8')
+    finally:
+        text_file.close()
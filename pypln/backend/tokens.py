@@ -0,0 +1,83 @@
+# coding: utf-8
+#
+# Copyright 2015 NAMD-EMAP-FGV
+#
+# This file is part of PyPLN. You can get more information at: http://pypln.org/.
+#
+# PyPLN is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyPLN is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
+"""
+With `config.COMPACT_TOKENS`, the Tokenizer does not store the tokens and
+sentences of the document as lists of strings (`tokens` and `sentences`
+are `None`) but as a vocabulary with the distinct tokens (`vocabulary`),
+the index in it of each token (`token_ids`) and the index of the first
+token of each sentence, followed by the number of tokens
+(`sentence_offsets`), the last two packed (see `pypln.backend.packing`).
+
+Workers should get them with `document_tokens` and `document_sentences`,
+and require the fields in `TOKEN_FIELDS` or `SENTENCE_FIELDS`.
+"""
+from pypln.backend.packing import pack_ints, unpack_ints
+
+
+TOKEN_FIELDS = ['tokens', 'vocabulary', 'token_ids']
+SENTENCE_FIELDS = ['sentences', 'vocabulary', 'token_ids', 'sentence_offsets']
+
+def compact_tokens(sentences):
+    """
+    Returns the fields of the compact representation of the sentences.
+    """
+    ids = {}
+    vocabulary = []
+    token_ids = []
+    sentence_offsets = []
+    for sentence in sentences:
+        sentence_offsets.append(len(token_ids))
+        for token in sentence:
+            token_id = ids.get(token)
+            if token_id is None:
+                token_id = ids[token] = len(vocabulary)
+                vocabulary.append(token)
+            token_ids.append(token_id)
+    sentence_offsets.append(len(token_ids))
+    return {'tokens': None, 'sentences': None, 'vocabulary': vocabulary,
+            'token_ids': pack_ints(token_ids),
+            'sentence_offsets': pack_ints(sentence_offsets)}
+
+def is_compact(document):
+    return document.get('token_ids') is not None
+
+def document_tokens(document, materialize=True):
+    """
+    Returns the tokens of the document. With `materialize=False`, compact
+    documents give the ids of the tokens instead, which is enough for
+    counting them.
+    """
+    if not is_compact(document):
+        return document['tokens']
+    token_ids = unpack_ints(document['token_ids'])
+    if not materialize:
+        return token_ids
+    vocabulary = document['vocabulary']
+    return [vocabulary[token_id] for token_id in token_ids]
+
+def document_sentences(document, materialize=True):
+    """
+    Returns the sentences of the document, as lists of tokens (or of token
+    ids, see `document_tokens`).
+    """
+    if not is_compact(document):
+        return document['sentences']
+    tokens = document_tokens(document, materialize)
+    offsets = unpack_ints(document['sentence_offsets'])
+    return [tokens[start:end] for start, end in zip(offsets, offsets[1:])]
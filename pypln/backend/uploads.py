@@ -0,0 +1,56 @@
+# coding: utf-8
+#
+# Copyright 2015 NAMD-EMAP-FGV
+#
+# This file is part of PyPLN. You can get more information at: http://pypln.org/.
+#
+# PyPLN is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyPLN is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Raw uploads are stored in GridFS instead of inside the analysis document
+(as base64 `contents`). Each file is stored once, with the SHA-256 digest
+of its contents as `_id`, and the analysis documents only keep the digest
+in `contents_digest`.
+"""
+import hashlib
+
+import gridfs
+from gridfs.errors import FileExists
+
+from pypln.backend import config
+from pypln.backend.celery_task import get_database
+
+
+def get_upload_store():
+    return gridfs.GridFS(get_database(), config.MONGODB_UPLOADS_COLLECTION)
+
+def store_upload(data, filename=None):
+    """
+    Stores the contents of an uploaded file, unless they are already
+    stored, and returns their digest.
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    store = get_upload_store()
+    if not store.exists(digest):
+        try:
+            store.put(data, _id=digest, filename=filename)
+        except FileExists:
+            # The same contents were stored by another process meanwhile.
+            pass
+    return digest
+
+def open_upload(digest):
+    """
+    Returns a file-like object to read the contents stored with `digest`.
+    """
+    return get_upload_store().get(digest)
@@ -0,0 +1,93 @@
+# coding: utf-8
+#
+# Copyright 2015 NAMD-EMAP-FGV
+#
+# This file is part of PyPLN. You can get more information at: http://pypln.org/.
+#
+# PyPLN is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyPLN is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Loads the models used by the workers before Celery forks its child
+processes. This way the children share them (copy-on-write) instead of each
+one loading them again when it runs its first task, which also happens every
+time a child is replaced (see `CELERYD_MAX_TASKS_PER_CHILD`).
+"""
+from time import time
+
+from celery.utils.log import get_logger
+
+
+logger = get_logger(__name__)
+
+def load_punkt():
+    import nltk
+    # `nltk.sent_tokenize` and `nltk.word_tokenize` get the tokenizer from
+    # the same cache used by `nltk.data.load`.
+    nltk.data.load('tokenizers/punkt/english.pickle')
+
+def load_pos_tagger():
+    from pypln.backend.workers.pos import en_nltk
+    en_nltk.get_tagger()
+
+def load_stopwords():
+    from pypln.backend.workers import word_cloud
+    for language in ('en', 'pt'):
+        word_cloud.get_stopwords(language)
+
+def load_spellchecker_dictionaries():
+    from pypln.backend.celery_app import app
+    from pypln.backend.workers.spellchecker import SpellingChecker
+    # The enchant dictionaries are loaded when the task is instantiated.
+    app.tasks[SpellingChecker.name]
+
+def load_magic_database():
+    import magic
+    from pypln.backend.workers import extractor
+    extractor.get_magic(magic.MAGIC_MIME_TYPE)
+    extractor.get_magic(magic.MAGIC_MIME_ENCODING)
+
+# Each model, the workers that use it and the function that loads it.
+MODELS = [
+    ('magic database', ['Extractor'], load_magic_database),
+    ('punkt', ['Tokenizer'], load_punkt),
+    ('pos tagger', ['POS'], load_pos_tagger),
+    ('stopwords', ['WordCloud'], load_stopwords),
+    ('spellchecker dictionaries', ['SpellingChecker'],
+        load_spellchecker_dictionaries),
+]
+
+def warm_up(workers=None):
+    """
+    Loads the models used by the given workers (by default, every worker
+    in `pypln.backend.workers.WORKER_MODULES`, including the ones that are
+    not part of the default pipeline, like the SpellingChecker), logging how
+    long each one took.
+    Returns a dictionary with the load time (in seconds) of each model.
+    Models that fail to load are logged and left out, since the worker can
+    still load them later.
+    """
+    if not workers:
+        from pypln.backend.workers import WORKER_MODULES as workers
+    load_times = {}
+    for name, used_by, load in MODELS:
+        if not set(used_by) & set(workers):
+            continue
+        start = time()
+        try:
+            load()
+        except Exception:
+            logger.exception('Could not load {}'.format(name))
+            continue
+        load_times[name] = time() - start
+        logger.info('Loaded {} in {:.3f}s'.format(name, load_times[name]))
+    return load_times
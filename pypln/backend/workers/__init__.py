@@ -17,20 +17,151 @@
 # You should have received a copy of the GNU General Public License
 # along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
 
-from extractor import Extractor
-from tokenizer import Tokenizer
-from freqdist import FreqDist
-from pos import POS
-from statistics import Statistics
-from bigrams import Bigrams
-from palavras_raw import PalavrasRaw
-from lemmatizer_pt import Lemmatizer
-from palavras_noun_phrase import NounPhrase
-from palavras_semantic_tagger import SemanticTagger
-from word_cloud import WordCloud
-from elastic_indexer import ElasticIndexer
+import sys
+from collections import namedtuple
+from importlib import import_module
+from time import time
+from types import ModuleType
 
+from celery.utils.log import get_logger
+
+from pypln.backend.tokens import SENTENCE_FIELDS, TOKEN_FIELDS
+
+
+logger = get_logger(__name__)
+
+# The module (inside this package) that defines each worker. Worker modules
+# import heavy dependencies (nltk, numpy, wordcloud, elasticsearch, ...), so
+# they are only imported when the worker is first accessed, or when a Celery
+# worker is started to run it (see `config.PYPLN_WORKERS`).
+WORKER_MODULES = {
+    'Extractor': 'extractor',
+    'Tokenizer': 'tokenizer',
+    'FreqDist': 'freqdist',
+    'POS': 'pos',
+    'Statistics': 'statistics',
+    'Bigrams': 'bigrams',
+    'Trigrams': 'trigrams',
+    'PalavrasRaw': 'palavras_raw',
+    'Lemmatizer': 'lemmatizer_pt',
+    'NounPhrase': 'palavras_noun_phrase',
+    'SemanticTagger': 'palavras_semantic_tagger',
+    'SpellingChecker': 'spellchecker',
+    'WordCloud': 'word_cloud',
+    'ElasticIndexer': 'elastic_indexer',
+}
 
 __all__ = ['Extractor', 'Tokenizer', 'FreqDist', 'POS', 'Statistics',
         'Bigrams', 'PalavrasRaw', 'Lemmatizer', 'NounPhrase', 'SemanticTagger',
         'WordCloud', 'ElasticIndexer']
+
+WorkerMetadata = namedtuple('WorkerMetadata', ['requires', 'provides',
+    'version', 'settings'])
+
+# The `requires`, `provides`, `version` and `settings` of each worker (see
+# `PyPLNTask`). The worker classes define them too (and `test_workers`
+# checks that they match); they are repeated here so the workers whose
+# results a worker uses, which are part of its cache key, can be found
+# without importing their modules.
+WORKER_METADATA = {
+    'Extractor': WorkerMetadata(['contents'], ['text', 'text_file_id',
+        'file_metadata', 'language', 'mimetype', 'forced_decoding',
+        'contents_digest', 'scratch_bytes_written', 'extraction_error'], 1,
+        ['EXTRACTOR_BACKENDS', 'EXTRACTOR_BACKEND_MAX_SIZES',
+            'STREAMING_EXTRACTION_MIN_SIZE']),
+    'Tokenizer': WorkerMetadata(['text', 'text_file_id'], ['tokens',
+        'sentences', 'vocabulary', 'token_ids', 'sentence_offsets',
+        'token_spans', 'sentence_spans'], 2, ['TOKENIZER_PARALLEL_MIN_SIZE',
+            'TOKENIZER_CHUNK_SIZE', 'COMPACT_TOKENS']),
+    'FreqDist': WorkerMetadata(TOKEN_FIELDS, ['freqdist'], 2,
+        ['FREQDIST_TOP_K', 'FREQDIST_MIN_COUNT']),
+    'POS': WorkerMetadata(['language', 'token_spans', 'palavras_raw'] +
+        TOKEN_FIELDS, ['pos', 'tagset'], 2, []),
+    'Statistics': WorkerMetadata(['freqdist'] + SENTENCE_FIELDS,
+        ['momentum_1', 'momentum_2', 'momentum_3', 'momentum_4',
+            'repertoire', 'average_sentence_length',
+            'average_sentence_repertoire'], 1, []),
+    'Bigrams': WorkerMetadata(TOKEN_FIELDS, ['metrics', 'bigram_rank'], 1,
+        []),
+    'Trigrams': WorkerMetadata(TOKEN_FIELDS, ['trigram_rank', 'metrics'], 1,
+        []),
+    'PalavrasRaw': WorkerMetadata(['language', 'text', 'text_file_id'],
+        ['palavras_raw', 'palavras_raw_ran'], 1, []),
+    'Lemmatizer': WorkerMetadata(['palavras_raw_ran', 'palavras_raw'],
+        ['lemmas'], 1, []),
+    'NounPhrase': WorkerMetadata(['palavras_raw_ran', 'palavras_raw'],
+        ['noun_phrases'], 1, []),
+    'SemanticTagger': WorkerMetadata(['palavras_raw_ran', 'palavras_raw'],
+        ['semantic_tags'], 1, []),
+    'SpellingChecker': WorkerMetadata(['language', 'text', 'text_file_id'],
+        ['spelling_errors'], 1, []),
+    'WordCloud': WorkerMetadata(['freqdist', 'language'], ['wordcloud'], 1,
+        []),
+    'ElasticIndexer': WorkerMetadata(None, None, 1, []),
+}
+
+def upstream_workers(requires):
+    """
+    Returns the names of the workers that provide any of the fields in
+    `requires` (every worker if it is `None`), and of every worker they
+    depend on, according to `WORKER_METADATA`.
+    """
+    if requires is None:
+        return set(WORKER_METADATA)
+    upstream = set()
+    pending = [requires]
+    while pending:
+        fields = set(pending.pop())
+        for name, metadata in WORKER_METADATA.items():
+            if name not in upstream and fields & set(metadata.provides or []):
+                upstream.add(name)
+                if metadata.requires is not None:
+                    pending.append(metadata.requires)
+    return upstream
+
+# How long (in seconds) it took to import each worker module in this process.
+import_times = {}
+
+def load_worker(name):
+    """
+    Imports the module that defines the worker (if it was not imported yet)
+    and returns the worker class.
+    """
+    module_name = '{}.{}'.format(__name__, WORKER_MODULES[name])
+    if module_name not in sys.modules:
+        start = time()
+        import_module(module_name)
+        import_times[module_name] = time() - start
+        logger.info('Imported {} in {:.3f}s'.format(module_name,
+            import_times[module_name]))
+    worker = getattr(sys.modules[module_name], name)
+    setattr(sys.modules[__name__], name, worker)
+    return worker
+
+def load_workers(names=None):
+    """
+    Imports the given workers (by default, the ones in `__all__`) and returns
+    their classes.
+    """
+    return [load_worker(name) for name in (names or __all__)]
+
+
+class _LazyWorkersModule(ModuleType):
+    """
+    Replaces this module in `sys.modules`, so accessing a worker (like in
+    `from pypln.backend.workers import Tokenizer`) imports its module.
+    """
+
+    def __getattr__(self, name):
+        if name not in WORKER_MODULES:
+            raise AttributeError("'module' object has no attribute "
+                    "'{}'".format(name))
+        return load_worker(name)
+
+
+_lazy_module = _LazyWorkersModule(__name__, __doc__)
+_lazy_module.__dict__.update(sys.modules[__name__].__dict__)
+# Python 2 clears the globals of a module when it is garbage collected, and the
+# functions above still use them, so we need to keep the original one alive.
+_lazy_module._original_module = sys.modules[__name__]
+sys.modules[__name__] = _lazy_module
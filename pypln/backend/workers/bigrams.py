@@ -22,10 +22,13 @@ from collections import defaultdict
 
 from nltk.collocations import BigramCollocationFinder
 from pypln.backend.celery_task import PyPLNTask
+from pypln.backend.tokens import TOKEN_FIELDS, document_tokens
 
 
 class Bigrams(PyPLNTask):
     """Create a NLTK bigram finder and return a table in JSON format"""
+    requires = TOKEN_FIELDS
+    provides = ['metrics', 'bigram_rank']
 
     def process(self, document):
         #todo: support filtering by stopwords
@@ -40,7 +43,8 @@ class Bigrams(PyPLNTask):
                'poisson_stirling',
                'raw_freq',
                'student_t']
-        bigram_finder = BigramCollocationFinder.from_words(document['tokens'])
+        bigram_finder = BigramCollocationFinder.from_words(
+                document_tokens(document))
         br = defaultdict(lambda :[])
         for m in metrics:
             for res in bigram_finder.score_ngrams(getattr(bigram_measures,m)):
@@ -17,30 +17,61 @@
 # You should have received a copy of the GNU General Public License
 # along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
 
+from bson.binary import Binary
 from pypln.backend.celery_task import PyPLNTask
 from elasticsearch import Elasticsearch
 from pypln.backend.config import ELASTICSEARCH_CONFIG
+from pypln.backend.texts import document_text
+from pypln.backend.tokens import (document_sentences, document_tokens,
+        is_compact)
 
-ES = Elasticsearch(hosts=ELASTICSEARCH_CONFIG['hosts'])
+ES = None
+
+def get_elasticsearch():
+    # The client is only created when the first document is indexed, so
+    # importing this module does not require Elasticsearch to be available.
+    global ES
+    if ES is None:
+        ES = Elasticsearch(hosts=ELASTICSEARCH_CONFIG['hosts'])
+    return ES
 
 class ElasticIndexer(PyPLNTask):
     """
     Index document in an elasticsearch index specified in the document as `index_name`.
     """
+    cacheable = False
+
     def process(self, document):
         index_name = document.pop("index_name")
         doc_type = document.pop('doc_type')
         file_id = document["file_id"]
-        ES.indices.create(index_name, ignore=400)
-        # We need to remove the raw contents of the file.
+        es = get_elasticsearch()
+        es.indices.create(index_name, ignore=400)
+        # We need to remove the raw contents of the file (only present in
+        # documents created before the uploads were stored in GridFS).
         # See `test_regression_indexing_should_not_include_contents` in
         # tests/test_elastic_indexer.py for details.
-        document.pop('contents')
+        document.pop('contents', None)
         # We also need to exclude _id, because ObjectId's won't be
-        # serializable.
+        # serializable. For the same reason, the text of very large documents
+        # is read from GridFS instead of sending the id of its file.
         document.pop("_id")
+        if document.get('text_file_id') is not None:
+            document['text'] = document_text(document)
+        document.pop('text_file_id', None)
+        # Compact documents (see `config.COMPACT_TOKENS`) are indexed with
+        # their tokens and sentences, like the others.
+        if is_compact(document):
+            document['tokens'] = document_tokens(document)
+            document['sentences'] = document_sentences(document)
+        for key in ('vocabulary', 'token_ids', 'sentence_offsets'):
+            document.pop(key, None)
+        # Packed values (like `token_spans`) are not JSON serializable either.
+        for key, value in document.items():
+            if isinstance(value, Binary):
+                del document[key]
 
-        result = ES.index(index=index_name, doc_type=doc_type,
+        result = es.index(index=index_name, doc_type=doc_type,
                 body=document, id=file_id)
         index_id = result.pop("_id")
         result["index_id"] = index_id
@@ -18,74 +18,334 @@
 # along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
 
 import base64
+import codecs
+import hashlib
 import shlex
 
+from cStringIO import StringIO
+from contextlib import closing
+from functools import partial
 from HTMLParser import HTMLParser
-from tempfile import NamedTemporaryFile
-from os import unlink
-from subprocess import Popen, PIPE
+from multiprocessing.pool import ThreadPool
+from tempfile import mkdtemp
+from threading import BoundedSemaphore, Lock
+from os import listdir, path, SEEK_END
+from shutil import rmtree
 from mimetypes import guess_type
-from re import compile as regexp_compile, DOTALL, escape
+from re import compile as regexp_compile, DOTALL, escape, IGNORECASE
 
 import cld
 import magic
 
-from pypln.backend.celery_task import PyPLNTask
+try:
+    import PyPDF2
+except ImportError:
+    # Only needed by the `pypdf2` backend, which is optional.
+    PyPDF2 = None
+
+from pypln.backend import config, sandbox
+from pypln.backend.celery_task import PyPLNTask, get_cache
+from pypln.backend.texts import delete_text_file, new_text_file
+from pypln.backend.uploads import open_upload
 
 
 regexp_tags = regexp_compile(r'(<[ \t]*([a-zA-Z0-9!"./_-]*)[^>]*>)', flags=DOTALL)
+regexp_tag_name = regexp_compile(r'<[ \t]*([a-zA-Z0-9!"./_-]*)')
 regexp_comment = regexp_compile(r'<!--.*?-->', flags=DOTALL)
-regexp_spaces_start = regexp_compile('([\n]+)[ \t]*',
-        flags=DOTALL)
-regexp_spaces_end = regexp_compile('[ \t]*\n', flags=DOTALL)
-regexp_newlines = regexp_compile('[\n]{3,}', flags=DOTALL)
-regexp_spaces = regexp_compile('[ \t]{2,}', flags=DOTALL)
-regexp_punctuation = regexp_compile('[ \t]*([' + escape('!,.:;?') + '])',
-        flags=DOTALL)
+regexp_body = regexp_compile(r'<[ \t]*body[^>]*>', flags=IGNORECASE)
+regexp_entity = regexp_compile(r'&[#xX\w]*$')
+# Whitespace with line breaks, before punctuation and repeated spaces
+regexp_whitespace = regexp_compile('(?P<newlines>[ \t]*\n[ \t\n]*)|'
+        '[ \t]+(?=[' + escape('!,.:;?') + '])|(?P<spaces>[ \t]{2,})')
 breakline_tags = ['table', '/table', 'tr', 'div', '/div', 'h1', '/h1', 'h2',
                   '/h2', 'h3', '/h3', 'h4', '/h4', 'h5', '/h5', 'h6', '/h6',
                   'br', 'br/']
 double_breakline = ['table', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6']
 
+def normalize_whitespace(match):
+    newlines = match.group('newlines')
+    if newlines is not None:
+        return '\n\n' if newlines.count('\n') > 1 else '\n'
+    elif match.group('spaces') is not None:
+        return ' '
+    return ''
+
+def normalize(text):
+    """
+    Normalizes the whitespace in the text, in a single pass: spaces around
+    line breaks and before punctuation are removed, more than two line
+    breaks become two and repeated spaces become one.
+    """
+    return regexp_whitespace.sub(normalize_whitespace, text)
+
 def clean(text):
-    text = regexp_spaces_start.sub(r'\1', text)
-    text = regexp_spaces_end.sub('\n', text)
-    text = regexp_newlines.sub('\n\n', text)
-    text = regexp_spaces.sub(' ', text)
-    text = regexp_punctuation.sub(r'\1', text)
-    return text.strip()
+    return normalize(text).strip()
 
-def parse_html(html, remove_tags=None, remove_inside=None,
-               replace_space_with=' ', replace_newline_with='\n'):
-    html = regexp_comment.sub('', html.replace('\n', ''))
-    data = regexp_tags.split(html)
-    content_between = data[::3]
-    complete_tags = data[1::3]
-    tag_names = [x.lower() for x in data[2::3]]
-    for index, tag_name in enumerate(tag_names):
-        if not tag_name.strip():
-            continue
+def partial_suffix_length(text, token):
+    """
+    Returns the length of the longest prefix of `token` that `text` ends
+    with (not counting `token` itself).
+    """
+    for length in range(len(token) - 1, 0, -1):
+        if text.endswith(token[:length]):
+            return length
+    return 0
+
+
+class HTMLTextExtractor(object):
+    """
+    Extracts the text of an HTML document in a single pass. The document can
+    be given in chunks of any size (see `feed`), and each chunk is processed
+    as it arrives, so the running time is linear in the size of the document.
+
+    Line breaks and comments are removed from the HTML. If `remove_tags` is
+    set every tag is replaced by `replace_space_with`, or by
+    `replace_newline_with` (twice for tables and headers) if it breaks the
+    line. The tags listed in `remove_inside` (like `script` and `style`) are
+    removed with everything up to the closing tag, which leaves a line break
+    in their place. A tag that is never closed removes everything up to the
+    end of the document.
+    """
+
+    def __init__(self, remove_tags=None, remove_inside=None,
+                 replace_space_with=' ', replace_newline_with='\n'):
+        self.remove_tags = remove_tags
+        self.remove_inside = set(remove_inside or [])
+        self.replace_space_with = replace_space_with
+        self.replace_newline_with = replace_newline_with
+        self._pieces = []
+        # Start of a comment that may have been cut at the end of a chunk
+        self._held = ''
+        # Chunks of the comment or tag being read, if any
+        self._comment = None
+        self._comment_tail = ''
+        self._tag = None
+        # Tags listed in `remove_inside` that were not closed yet
+        self._open_regions = set()
+        self._skip_content = False
+
+    def feed(self, data):
+        self._split_tags(self._strip_comments(data.replace('\n', '')))
+
+    def read(self):
+        """
+        Returns the text extracted so far that was not returned yet.
+        """
+        text = ''.join(self._pieces)
+        self._pieces = []
+        return text
+
+    def close(self):
+        """
+        Processes what is left of the document and returns the rest of its
+        text (all of it, if `read` was not used).
+        """
+        if self._comment is not None:
+            # Like the regular expressions this replaced, a comment that is
+            # never closed is kept as text.
+            rest = ''.join(self._comment)
+        else:
+            rest = self._held
+        self._comment = None
+        self._held = ''
+        self._split_tags(rest)
+        if self._tag is not None:
+            self._handle_content(''.join(self._tag))
+            self._tag = None
+        return ''.join(self._pieces)
+
+    def _strip_comments(self, data):
+        pieces = []
+        position = 0
+        while True:
+            if self._comment is None:
+                if self._held:
+                    data = self._held + data[position:]
+                    position = 0
+                    self._held = ''
+                start = data.find('<!--', position)
+                if start == -1:
+                    keep = len(data) - partial_suffix_length(data, '<!--')
+                    keep = max(keep, position)
+                    pieces.append(data[position:keep])
+                    self._held = data[keep:]
+                    break
+                pieces.append(data[position:start])
+                self._comment = ['<!--']
+                self._comment_tail = ''
+                position = start + 4
+            else:
+                # The end of the comment may start in the previous chunk.
+                text = self._comment_tail + data[position:position + 2]
+                end = text.find('-->')
+                if end == -1:
+                    end = data.find('-->', position)
+                    if end == -1:
+                        self._comment.append(data[position:])
+                        self._comment_tail = (self._comment_tail +
+                                data[position:])[-2:]
+                        break
+                    end += 3
+                else:
+                    end += 3 - len(self._comment_tail) + position
+                self._comment = None
+                position = end
+        return ''.join(pieces)
+
+    def _split_tags(self, data):
+        position = 0
+        while position < len(data):
+            if self._tag is None:
+                start = data.find('<', position)
+                if start == -1:
+                    self._handle_content(data[position:])
+                    break
+                self._handle_content(data[position:start])
+                self._tag = []
+                position = start
+                end = data.find('>', start + 1)
+            else:
+                end = data.find('>', position)
+            if end == -1:
+                self._tag.append(data[position:])
+                break
+            self._tag.append(data[position:end + 1])
+            self._handle_tag(''.join(self._tag))
+            self._tag = None
+            position = end + 1
+
+    def _handle_content(self, content):
+        if content and not self._skip_content:
+            self._pieces.append(content)
+
+    def _handle_tag(self, tag):
+        tag_name = regexp_tag_name.match(tag).group(1).lower()
         search_tag = tag_name
         if tag_name and tag_name[0] == '/':
             search_tag = tag_name[1:]
-        if remove_tags and search_tag not in remove_inside:
+        starts_region = bool(tag_name) and tag_name in self.remove_inside
+        if tag_name and self.remove_tags and \
+                search_tag not in self.remove_inside:
             if tag_name in breakline_tags:
                 if search_tag in double_breakline:
-                    complete_tags[index] = 2 * replace_newline_with
+                    tag = 2 * self.replace_newline_with
                 else:
-                    complete_tags[index] = replace_newline_with
+                    tag = self.replace_newline_with
             else:
-                complete_tags[index] = replace_space_with
-        if remove_inside and tag_name in remove_inside:
-            remove_to = tag_names.index('/' + tag_name, index)
-            total_to_remove = remove_to - index + 1
-            complete_tags[index:remove_to + 1] = [''] * total_to_remove
-            content_between[index + 2:remove_to + 1] = \
-                    [''] * (total_to_remove - 2)
-            content_between[index + 1] = '\n'
-    complete_tags.append('')
-    result = ''.join(sum(zip(content_between, complete_tags), tuple()))
-    return clean(result)
+                tag = self.replace_space_with
+        elif starts_region or self._open_regions:
+            tag = ''
+        self._pieces.append(tag)
+
+        if tag_name != search_tag:
+            self._open_regions.discard(search_tag)
+        if starts_region:
+            self._open_regions.add(tag_name)
+            self._pieces.append('\n')
+        self._skip_content = bool(self._open_regions)
+
+def parse_html(html, remove_tags=None, remove_inside=None,
+               replace_space_with=' ', replace_newline_with='\n'):
+    parser = HTMLTextExtractor(remove_tags, remove_inside,
+            replace_space_with, replace_newline_with)
+    parser.feed(html)
+    # The whitespace is normalized by the caller (see `clean`).
+    return parser.close()
+
+class TextCleaner(object):
+    """
+    Unescapes the HTML entities and normalizes the whitespace of a text
+    given in chunks, with the same result as applying
+    `HTMLParser().unescape` and `clean` to the whole text. Every call to
+    `feed` returns the text that is ready; the end of a chunk that could be
+    part of an entity or of a sequence of whitespace is kept for the next.
+    """
+
+    def __init__(self):
+        self._parser = HTMLParser()
+        self._entity_start = u''
+        self._whitespace = u''
+        self._started = False
+
+    def feed(self, text):
+        text = self._entity_start + text
+        entity = regexp_entity.search(text, max(len(text) - 36, 0))
+        if entity is None:
+            self._entity_start = u''
+        else:
+            self._entity_start = text[entity.start():]
+            text = text[:entity.start()]
+        return self._normalize(self._parser.unescape(text))
+
+    def close(self):
+        text = self._normalize(self._parser.unescape(self._entity_start))
+        self._entity_start = u''
+        return text + normalize(self._whitespace).rstrip()
+
+    def _normalize(self, text):
+        text = self._whitespace + text
+        stripped = text.rstrip()
+        self._whitespace = text[len(stripped):]
+        text = normalize(stripped)
+        if not self._started:
+            text = text.lstrip()
+            self._started = bool(text)
+        return text
+
+
+class TextStream(object):
+    """
+    Extracts the text of a plain text or HTML upload given in chunks (see
+    `feed`), like the Extractor does with whole uploads: the HTML is parsed,
+    then the text is decoded with `encoding` and cleaned (see `TextCleaner`).
+    """
+
+    def __init__(self, mime_type, encoding):
+        self._html = None
+        if mime_type == 'text/html':
+            self._html = HTMLTextExtractor(True, ['script', 'style'])
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+        self._cleaner = TextCleaner()
+
+    def feed(self, data):
+        if self._html is not None:
+            self._html.feed(data)
+            data = self._html.read()
+        return self._cleaner.feed(self._decoder.decode(data))
+
+    def close(self):
+        data = self._html.close() if self._html is not None else ''
+        text = self._cleaner.feed(self._decoder.decode(data, final=True))
+        return text + self._cleaner.close()
+
+
+class LanguageSampler(object):
+    """
+    Collects a sample of a text written in chunks, like `language_sample`
+    does with the whole text. The text is not known in advance, so the
+    slices start at the chunks that come from evenly spaced positions of the
+    upload (with `size` bytes).
+    """
+
+    def __init__(self, size, sample_size, slices=4):
+        self.starts = [index * size // slices for index in range(slices)]
+        self.length = sample_size // slices
+        self.parts = [u''] * slices
+
+    def add(self, text, position):
+        """
+        Adds the text extracted from the upload bytes that start at
+        `position`.
+        """
+        index = max(index for index, start in enumerate(self.starts)
+                if start <= position)
+        missing = self.length - len(self.parts[index])
+        if missing > 0:
+            self.parts[index] += text[:missing]
+
+    def sample(self):
+        return u'\n'.join(part for part in self.parts if part)
+
 
 def get_pdf_metadata(data):
     lines = data.strip().splitlines()
@@ -98,35 +358,353 @@ def get_pdf_metadata(data):
         metadata[key.strip()] = value.strip()
     return metadata
 
-def extract_pdf(data):
-    temp = NamedTemporaryFile(delete=False)
-    filename = temp.name
-    temp.close()
-    pdf2html = Popen(shlex.split('pdftohtml -q -i - {}'.format(temp.name)),
-                     stdin=PIPE, stdout=PIPE, stderr=PIPE)
-    html, html_err = pdf2html.communicate(input=data)
-    fp = open(filename + 's.html', 'r')
-    html = fp.read()
-    fp.close()
-    unlink(filename + '.html')
-    unlink(filename + '_ind.html')
-    unlink(filename + 's.html')
-    text = parse_html(html.replace('&#160;', ' '), True, ['script', 'style'])
-    pdfinfo = Popen(shlex.split('pdfinfo -'), stdin=PIPE, stdout=PIPE,
-                    stderr=PIPE)
-    meta_out, meta_err = pdfinfo.communicate(input=data)
+def run_sandboxed(command, data, timeout=None, on_start=None):
+    megabyte = 1024 * 1024
+    if timeout is None:
+        timeout = config.EXTRACTOR_TIMEOUT
+    return sandbox.run(shlex.split(command), data, timeout=timeout,
+            cpu_time=config.EXTRACTOR_CPU_TIME,
+            memory=config.EXTRACTOR_MEMORY_LIMIT * megabyte,
+            max_output=config.EXTRACTOR_MAX_OUTPUT * megabyte,
+            on_start=on_start)
+
+def get_pdf_info(data, timeout=None, on_start=None):
+    return run_sandboxed('pdfinfo -', data, timeout, on_start)
+
+def pdf_to_html(data, scratch_dir, first_page=None, last_page=None,
+        timeout=None, on_start=None):
+    """
+    Converts the PDF (from `first_page` to `last_page`, if given) to HTML
+    using `pdftohtml`, which writes its files in `scratch_dir`. Returns the
+    HTML and the errors reported.
+    """
+    filename = path.join(scratch_dir, 'pages{}'.format(first_page or 1))
+    page_range = ''
+    if first_page is not None:
+        page_range += ' -f {}'.format(first_page)
+    if last_page is not None:
+        page_range += ' -l {}'.format(last_page)
+    html, html_err = run_sandboxed('pdftohtml -q -i{} - {}'.format(
+        page_range, filename), data, timeout, on_start)
+    # Besides this file, `pdftohtml` writes a frameset (`.html`) and an
+    # index (`_ind.html`), which are removed with the scratch directory.
+    if not path.exists(filename + 's.html'):
+        return '', html_err or 'pdftohtml did not convert the PDF'
+    with open(filename + 's.html', 'r') as fp:
+        html = fp.read()
+    return html, html_err
+
+def directory_size(directory):
+    return sum(path.getsize(path.join(directory, filename))
+            for filename in listdir(directory))
+
+def strip_html_head(html):
+    body = regexp_body.search(html)
+    return html[body.end():] if body else html
+
+def page_ranges(pages, pages_per_chunk):
+    """
+    Returns the (first page, last page) of each chunk of the PDF after the
+    first one.
+    """
+    return [(first_page, min(first_page + pages_per_chunk - 1, pages))
+            for first_page in range(pages_per_chunk + 1, pages + 1,
+                pages_per_chunk)]
+
+def extract_pdf(data, timeout=None):
+    """
+    Returns the text and metadata of the PDF, and the number of bytes
+    written to the scratch directory to extract them. `timeout` is the limit
+    of each program run (by default, `config.EXTRACTOR_TIMEOUT`).
+    """
+    pages_per_chunk = config.PDF_PAGES_PER_CHUNK or None
+    scratch_dir = mkdtemp(prefix='pypln-extractor-',
+            dir=config.EXTRACTOR_SCRATCH_DIR or None)
+    # One more thread runs `pdfinfo` along with the conversion of the first
+    # chunk, which is the whole document for short PDFs. The page count it
+    # reports tells which other chunks are needed.
+    pool = ThreadPool(config.PDF_MAX_PARALLEL_CHUNKS + 1)
+    processes = sandbox.ProcessRegistry()
     try:
-        metadata = get_pdf_metadata(meta_out)
+        info = pool.apply_async(get_pdf_info, (data, timeout, processes.add))
+        chunks = [pool.apply_async(pdf_to_html, (data, scratch_dir, None,
+            pages_per_chunk, timeout, processes.add))]
+        meta_out, meta_err = info.get()
+        try:
+            metadata = get_pdf_metadata(meta_out)
+        except:
+            metadata = {}
+            #TODO: what should I do here?
+        # `pdfinfo` only fails to report the page count when it can't read
+        # the PDF, and then there is no metadata and no text is returned.
+        if pages_per_chunk and metadata.get('Pages', '').isdigit():
+            pages = int(metadata['Pages'])
+            for first_page, last_page in page_ranges(pages, pages_per_chunk):
+                chunks.append(pool.apply_async(pdf_to_html,
+                    (data, scratch_dir, first_page, last_page, timeout,
+                        processes.add)))
+        htmls, html_errors = zip(*[chunk.get() for chunk in chunks])
+        bytes_written = directory_size(scratch_dir)
     except:
-        metadata = {}
-        #TODO: what should I do here?
-    if not (text and metadata):
-        return '', {}
+        # The other chunks are not needed anymore, and their programs would
+        # keep writing to the scratch directory.
+        processes.kill_all()
+        raise
+    finally:
+        pool.terminate()
+        # Waits for the threads, so no program is left running when the
+        # scratch directory is removed.
+        pool.join()
+        rmtree(scratch_dir, ignore_errors=True)
+    html_err = ''.join(html_errors)
+    # Each chunk is a complete HTML document; only the first one keeps its
+    # head (with the title) so the text is the same as converting the whole
+    # PDF at once.
+    text = ''.join(parse_html(html.replace('&#160;', ' '), True,
+        ['script', 'style']) for html in
+        [htmls[0]] + [strip_html_head(html) for html in htmls[1:]])
+    if not (text.strip() and metadata):
+        return '', {}, bytes_written
     elif not html_err:
-        return text, {} if meta_err else metadata
+        return text, {} if meta_err else metadata, bytes_written
     else:
-        return '', {}
+        return '', {}, bytes_written
+
+def extract_pdf_in_process(data):
+    """
+    Returns the text and metadata of the PDF, extracted by PyPDF2. Raises
+    `UnsupportedUpload` if it can't read the PDF or finds no text (like in
+    scanned documents), so `pdftohtml` can try. Hitting the time limit is not
+    a malformed PDF, so `sandbox.LimitExceeded` goes through untouched.
+    """
+    if PyPDF2 is None:
+        raise UnsupportedUpload('PyPDF2 is not installed')
+    try:
+        reader = PyPDF2.PdfFileReader(StringIO(data), strict=False)
+        if reader.isEncrypted:
+            reader.decrypt('')
+        text = u'\n\n'.join(page.extractText() for page in reader.pages)
+        info = reader.getDocumentInfo() or {}
+    except sandbox.LimitExceeded:
+        raise
+    except Exception as error:
+        # PyPDF2 raises all kinds of exceptions for malformed PDFs.
+        raise UnsupportedUpload('PyPDF2 could not read the PDF: {!r}'.format(
+            error))
+    if not text.strip():
+        raise UnsupportedUpload('PyPDF2 found no text in the PDF')
+    # The same keys `pdfinfo` reports.
+    metadata = {'Pages': str(reader.getNumPages())}
+    for key, value in info.items():
+        try:
+            metadata[key.lstrip('/')] = unicode(value.getObject()).strip()
+        except (AttributeError, UnicodeDecodeError):
+            continue
+    return text, metadata, 0
 
+def extract_plain_text(data):
+    return data, {}, 0
+
+def extract_html(data):
+    return parse_html(data, True, ['script', 'style']), {}, 0
+
+
+class UnsupportedUpload(Exception):
+    """
+    Raised by an extractor backend that can't extract the text of an upload
+    it was given, so the next backend for its MIME type is tried.
+    """
+    pass
+
+
+class ExtractorBackend(object):
+    """
+    A way of extracting the text of uploads with one of the `mime_types`.
+    `extract` receives the upload and returns its text (as a byte string,
+    still to be decoded, or as unicode), its metadata and the number of
+    bytes written to scratch directories to extract it.
+
+    The backends the Extractor uses are chosen by name in
+    `config.EXTRACTOR_BACKENDS`, which also sets the order they are tried,
+    and their limits are set in `config.EXTRACTOR_BACKEND_TIMEOUTS`,
+    `EXTRACTOR_BACKEND_MAX_SIZES` and `EXTRACTOR_BACKEND_CONCURRENCY`. The
+    timeout of backends that run programs (`in_process` is False) is given
+    to `extract` (as `timeout`) to limit each program; the others are
+    stopped by `sandbox.time_limit`.
+    """
+
+    def __init__(self, name, mime_types, extract, in_process=True):
+        self.name = name
+        self.mime_types = mime_types
+        self._extract = extract
+        self.in_process = in_process
+        self._slots = None
+        self._slots_lock = Lock()
+
+    @property
+    def timeout(self):
+        return config.EXTRACTOR_BACKEND_TIMEOUTS.get(self.name, 0)
+
+    @property
+    def max_size(self):
+        return config.EXTRACTOR_BACKEND_MAX_SIZES.get(self.name, 0)
+
+    def accepts(self, data):
+        return not self.max_size or len(data) <= self.max_size
+
+    def extract(self, data):
+        slots = self._get_slots()
+        if slots is not None:
+            slots.acquire()
+        try:
+            if not self.in_process:
+                return self._extract(data, timeout=self.timeout)
+            with sandbox.time_limit(self.timeout, self.name):
+                return self._extract(data)
+        finally:
+            if slots is not None:
+                slots.release()
+
+    def _get_slots(self):
+        concurrency = config.EXTRACTOR_BACKEND_CONCURRENCY.get(self.name)
+        if not concurrency:
+            return None
+        with self._slots_lock:
+            if self._slots is None:
+                self._slots = BoundedSemaphore(concurrency)
+        return self._slots
+
+
+backends = {}
+
+def register_backend(backend):
+    """
+    Makes the backend available to the Extractor (it is only used if its name
+    is in `config.EXTRACTOR_BACKENDS`).
+    """
+    backends[backend.name] = backend
+
+def get_backends(mime_type):
+    """
+    Returns the backends to try for uploads of this MIME type, in order.
+    """
+    return [backends[name] for name in config.EXTRACTOR_BACKENDS
+            if name in backends and mime_type in backends[name].mime_types]
+
+def extract_upload(mime_type, data):
+    """
+    Extracts the text of the upload with the first backend for its MIME type
+    that accepts it (see `ExtractorBackend`). Returns `None` if there is no
+    backend for the MIME type, and raises `sandbox.LimitExceeded` if one of
+    them hits its limits or none can extract the text (because the upload
+    is too big for them, for example).
+    """
+    candidates = get_backends(mime_type)
+    if not candidates:
+        return None
+    error = None
+    for backend in candidates:
+        if not backend.accepts(data):
+            error = error or sandbox.LimitExceeded(backend.name, 'input_size',
+                    '{} bytes'.format(len(data)))
+            continue
+        try:
+            return backend.extract(data)
+        except UnsupportedUpload:
+            continue
+    raise error or sandbox.LimitExceeded(candidates[-1].name,
+            'unsupported')
+
+register_backend(ExtractorBackend('plain-text', ['text/plain'],
+    extract_plain_text))
+register_backend(ExtractorBackend('html', ['text/html'], extract_html))
+register_backend(ExtractorBackend('pypdf2', ['application/pdf'],
+    extract_pdf_in_process))
+register_backend(ExtractorBackend('pdftohtml', ['application/pdf'],
+    extract_pdf, in_process=False))
+
+
+# Loading the magic database is expensive, so each process keeps its handles.
+_magic_handles = {}
+
+def get_magic(flags):
+    if flags not in _magic_handles:
+        _magic_handles[flags] = magic.Magic(flags=flags)
+    return _magic_handles[flags]
+
+def sniff_prefix(data, size):
+    """
+    Returns the first `size` bytes of `data`, cut after an ASCII byte near
+    the end (if there is one), so a multibyte character is not split in
+    half (libmagic would take the text for binary data).
+    """
+    if len(data) <= size:
+        return data
+    prefix = data[:size]
+    for index in range(size - 1, max(size - 8, 0) - 1, -1):
+        if ord(prefix[index]) < 128:
+            return prefix[:index + 1]
+    return prefix
+
+def detect_mime_type(data):
+    prefix = sniff_prefix(data, config.EXTRACTOR_SNIFF_SIZE)
+    mime_type = get_magic(magic.MAGIC_MIME_TYPE).id_buffer(prefix)
+    if mime_type == 'application/octet-stream' and len(prefix) < len(data):
+        # The prefix was not enough to tell.
+        mime_type = get_magic(magic.MAGIC_MIME_TYPE).id_buffer(data)
+    return mime_type
+
+def language_sample(text, size, slices=4):
+    """
+    Returns about `size` characters of the text, taken from `slices` evenly
+    spaced parts of it.
+    """
+    if len(text) <= size:
+        return text
+    step = len(text) // slices
+    length = size // slices
+    return '\n'.join(text[start:start + length]
+            for start in range(0, slices * step, step))
+
+def detect_language(text):
+    """
+    Returns the language of the text detected by `cld`, using a sample of it.
+    The whole text is only used when the result is not reliable.
+    """
+    sample = language_sample(text, config.LANGUAGE_SAMPLE_SIZE)
+    if isinstance(sample, unicode):
+        sample = sample.encode('utf-8')
+    language, reliable = cld.detect(sample)[1:3]
+    if not reliable and len(sample) < len(text):
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        language = cld.detect(text)[1]
+    return language
+
+def sniff_encoding(prefix):
+    """
+    Returns the encoding libmagic detects for the start of a text.
+    """
+    content_encoding = get_magic(magic.MAGIC_MIME_ENCODING).id_buffer(prefix)
+    if content_encoding == 'us-ascii':
+        # Only the start is known to be ASCII, which is also valid UTF-8.
+        content_encoding = 'utf-8'
+    return content_encoding
+
+def encoding_candidates(*encodings):
+    """
+    Returns the encodings Python knows, in the given order and without
+    repeating any of them (even if they are spelled differently).
+    """
+    candidates = []
+    for encoding in encodings:
+        try:
+            name = codecs.lookup(encoding).name
+        except (LookupError, TypeError):
+            continue
+        if name not in candidates:
+            candidates.append(name)
+    return candidates
 
 def trial_decode(text):
     """
@@ -134,11 +712,21 @@ def trial_decode(text):
     not supported, try utf-8, iso-8859-1 and ultimately falls back to decoding
     as utf-8 replacing invalid chars with `U+FFFD` (the replacement character).
 
+    The encoding of large texts is first detected from their start (see
+    `config.EXTRACTOR_SNIFF_SIZE`), and the whole text is only examined if it
+    can't be decoded with it.
+
     This is far from an ideal solution, but the extractor and the rest of the
     pipeline need an unicode object.
     """
-    with magic.Magic(flags=magic.MAGIC_MIME_ENCODING) as m:
-        content_encoding = m.id_buffer(text)
+    prefix = sniff_prefix(text, config.EXTRACTOR_SNIFF_SIZE)
+    if len(prefix) < len(text):
+        try:
+            return text.decode(sniff_encoding(prefix)), False
+        except (LookupError, UnicodeDecodeError):
+            pass
+
+    content_encoding = get_magic(magic.MAGIC_MIME_ENCODING).id_buffer(text)
 
     forced_decoding = False
     try:
@@ -166,21 +754,73 @@ def trial_decode(text):
 
 
 class Extractor(PyPLNTask):
-    #TODO: need to verify some exceptions when trying to convert 'evil' PDFs
+    """
+    Extracts the text of the uploaded file, which is read from the upload
+    store (see `pypln.backend.uploads`) or, in documents created before it
+    existed, from the base64 `contents`. If one of the programs used to
+    extract it hits its limits (see `pypln.backend.sandbox`), the document
+    gets an empty text and the reason in `extraction_error`.
+
+    Plain text and HTML uploads bigger than
+    `config.STREAMING_EXTRACTION_MIN_SIZE` are extracted in chunks, and
+    their text is written to GridFS (see `pypln.backend.texts`) instead of
+    `text`.
+
+    Results are cached in a cache of their own (see
+    `config.EXTRACTOR_CACHE_MAX_ENTRIES`), except failures like these.
+    """
     #TODO: should 'replace_with' be '' when extracting from HTML?
+    # `contents_digest` is also fetched (see `PyPLNTask`).
+    requires = ['contents']
+    provides = ['text', 'text_file_id', 'file_metadata', 'language',
+            'mimetype', 'forced_decoding', 'contents_digest',
+            'scratch_bytes_written', 'extraction_error']
+    settings = ['EXTRACTOR_BACKENDS', 'EXTRACTOR_BACKEND_MAX_SIZES',
+            'STREAMING_EXTRACTION_MIN_SIZE']
+
+    def get_result_cache(self):
+        return get_cache(config.MONGODB_EXTRACTOR_CACHE_COLLECTION,
+                config.EXTRACTOR_CACHE_MAX_ENTRIES,
+                config.EXTRACTOR_CACHE_TTL) or \
+                super(Extractor, self).get_result_cache()
+
+    def should_cache(self, result):
+        return not result.get('extraction_error')
+
+    def from_cache(self, result):
+        # Nothing was written to extract a cached result.
+        return dict(result, scratch_bytes_written=0)
 
     def process(self, file_data):
-        contents = base64.b64decode(file_data['contents'])
-        with magic.Magic(flags=magic.MAGIC_MIME_TYPE) as m:
-            file_mime_type = m.id_buffer(contents)
-        metadata = {}
-        if file_mime_type == 'text/plain':
-            text = contents
-        elif file_mime_type == 'text/html':
-            text = parse_html(contents, True, ['script', 'style'])
-        elif file_mime_type == 'application/pdf':
-            text, metadata = extract_pdf(contents)
+        if 'contents' in file_data:
+            contents = base64.b64decode(file_data['contents'])
+            digest = file_data.get('contents_digest') or \
+                    hashlib.sha256(contents).hexdigest()
+            open_contents = partial(StringIO, contents)
         else:
+            digest = file_data['contents_digest']
+            open_contents = partial(open_upload, digest)
+            contents = None
+        result = self.extract_streaming(open_contents, digest)
+        if result is not None:
+            return result
+        if contents is None:
+            with closing(open_contents()) as upload:
+                contents = upload.read()
+        file_mime_type = detect_mime_type(contents)
+        try:
+            # `scratch_bytes_written` is the number of bytes written to disk
+            # (or to the memory backed scratch directory) to extract the
+            # text.
+            extracted = extract_upload(file_mime_type, contents)
+        except sandbox.LimitExceeded as error:
+            return {'mimetype': file_mime_type, 'text': "",
+                    'text_file_id': None, 'file_metadata': {},
+                    'language': "",
+                    'forced_decoding': False, 'contents_digest': digest,
+                    'scratch_bytes_written': 0,
+                    'extraction_error': error.as_marker()}
+        if extracted is None:
             # If we can't detect the mimetype we add a flag that can be read by
             # the frontend to provide more information on why the document
             # wasn't processed.
@@ -188,10 +828,15 @@ class Extractor(PyPLNTask):
             # pipeline will run indefinitely. The right approach is to make
             # pypelinin understand an specific exception (something like
             # StopPipeline) as a signal to stop processing this pipeline.
-            return {'mimetype': 'unknown', 'text': "",
-                    'file_metadata': {}, 'language': ""}
+            return {'mimetype': 'unknown', 'text': "", 'text_file_id': None,
+                    'file_metadata': {}, 'language': "",
+                    'contents_digest': digest, 'scratch_bytes_written': 0,
+                    'extraction_error': None}
+        text, metadata, scratch_bytes_written = extracted
 
-        text, forced_decoding = trial_decode(text)
+        forced_decoding = False
+        if not isinstance(text, unicode):
+            text, forced_decoding = trial_decode(text)
 
         if isinstance(text, unicode):
             # HTMLParser only handles unicode objects. We can't pass the text
@@ -203,10 +848,68 @@ class Extractor(PyPLNTask):
 
         text = clean(text)
 
-        if isinstance(text, unicode):
-            language = cld.detect(text.encode('utf-8'))[1]
-        else:
-            language = cld.detect(text)[1]
+        language = detect_language(text)
+
+        return {'text': text, 'text_file_id': None, 'file_metadata': metadata,
+                'language': language, 'mimetype': file_mime_type,
+                'forced_decoding': forced_decoding, 'contents_digest': digest,
+                'scratch_bytes_written': scratch_bytes_written,
+                'extraction_error': None}
+
+    def extract_streaming(self, open_contents, digest):
+        """
+        Extracts the text of a plain text or HTML upload in chunks (see
+        `TextStream`) and writes it to GridFS. Returns `None`, without
+        reading the whole upload, if it is not one of them or is not big
+        enough (see `config.STREAMING_EXTRACTION_MIN_SIZE`).
+
+        The encoding is detected from the start of the upload; if the rest
+        can't be decoded with it, the extraction starts again with UTF-8 and
+        then ISO-8859-1 (which decodes anything). The language is detected
+        from a sample of the text (see `LanguageSampler`).
+        """
+        if not config.STREAMING_EXTRACTION_MIN_SIZE:
+            return None
+        with closing(open_contents()) as upload:
+            upload.seek(0, SEEK_END)
+            size = upload.tell()
+            if size < config.STREAMING_EXTRACTION_MIN_SIZE:
+                return None
+            upload.seek(0)
+            prefix = sniff_prefix(upload.read(config.EXTRACTOR_SNIFF_SIZE + 1),
+                    config.EXTRACTOR_SNIFF_SIZE)
+        mime_type = detect_mime_type(prefix)
+        # Only the `plain-text` and `html` backends can be streamed.
+        candidates = [backend.name for backend in get_backends(mime_type)]
+        if candidates[:1] not in (['plain-text'], ['html']):
+            return None
+
+        for encoding in encoding_candidates(sniff_encoding(prefix), 'utf-8',
+                'iso-8859-1'):
+            text_file = new_text_file(contents_digest=digest)
+            sampler = LanguageSampler(size, config.LANGUAGE_SAMPLE_SIZE)
+            try:
+                with closing(open_contents()) as upload:
+                    stream = TextStream(mime_type, encoding)
+                    position = 0
+                    for data in iter(partial(upload.read,
+                            config.STREAMING_CHUNK_SIZE), ''):
+                        text = stream.feed(data)
+                        sampler.add(text, position)
+                        text_file.write(text)
+                        position += len(data)
+                    text = stream.close()
+                    sampler.add(text, position)
+                    text_file.write(text)
+                text_file.close()
+                break
+            except UnicodeDecodeError:
+                text_file.close()
+                delete_text_file(text_file._id)
 
-        return {'text': text, 'file_metadata': metadata, 'language': language,
-                'mimetype': file_mime_type, 'forced_decoding': forced_decoding}
+        return {'text': None, 'text_file_id': text_file._id,
+                'file_metadata': {},
+                'language': detect_language(sampler.sample()),
+                'mimetype': mime_type, 'forced_decoding': False,
+                'contents_digest': digest, 'scratch_bytes_written': 0,
+                'extraction_error': None}
@@ -17,17 +17,60 @@
 # You should have received a copy of the GNU General Public License
 # along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
 
+from heapq import nlargest
+
+from pypln.backend import config
 from pypln.backend.celery_task import PyPLNTask
+from pypln.backend.tokens import TOKEN_FIELDS, document_tokens, is_compact
+
+
+def frequency_distribution(tokens, top_k=0, min_count=1):
+    """
+    Returns the `(token, count)` pairs of the tokens, the most frequent
+    first and tokens with the same count in the order they first appear.
+    Tokens that appear less than `min_count` times are left out and, if
+    `top_k` is given, only that many pairs are returned (selected with a
+    partial sort).
+    """
+    counts = {}
+    # The distinct tokens, in the order they first appear.
+    distinct = []
+    for token in tokens:
+        if token in counts:
+            counts[token] += 1
+        else:
+            counts[token] = 1
+            distinct.append(token)
+    if min_count > 1:
+        distinct = [token for token in distinct if counts[token] >= min_count]
+    # Both sorts are stable, so ties keep the order of `distinct`.
+    if top_k and top_k < len(distinct):
+        distinct = nlargest(top_k, distinct, key=counts.__getitem__)
+    else:
+        distinct.sort(key=counts.__getitem__, reverse=True)
+    return [(token, counts[token]) for token in distinct]
 
 
 class FreqDist(PyPLNTask):
-    def process(self, document):
-        document_tokens = document['tokens']
+    """
+    Counts the tokens of the document, ignoring case (see
+    `frequency_distribution`, and `config.FREQDIST_TOP_K` and
+    `config.FREQDIST_MIN_COUNT` for the cutoffs).
+    """
+    version = 2
+    requires = TOKEN_FIELDS
+    provides = ['freqdist']
+    settings = ['FREQDIST_TOP_K', 'FREQDIST_MIN_COUNT']
 
-        tokens = [info.lower() for info in document_tokens]
-        frequency_distribution = {token: tokens.count(token) \
-                                  for token in set(tokens)}
-        fd = frequency_distribution.items()
-        fd.sort(lambda x, y: cmp(y[1], x[1]))
+    def process(self, document):
+        if is_compact(document):
+            # Each distinct token is only lowercased once.
+            vocabulary = [token.lower() for token in document['vocabulary']]
+            tokens = [vocabulary[token_id] for token_id in
+                    document_tokens(document, materialize=False)]
+        else:
+            tokens = [token.lower() for token in document_tokens(document)]
+        fd = frequency_distribution(tokens, config.FREQDIST_TOP_K,
+                config.FREQDIST_MIN_COUNT)
 
         return {'freqdist': fd}
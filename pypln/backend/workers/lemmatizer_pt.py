@@ -22,6 +22,8 @@ from pypln.backend.celery_task import PyPLNTask
 
 class Lemmatizer(PyPLNTask):
     """Lemmatizer"""
+    requires = ['palavras_raw_ran', 'palavras_raw']
+    provides = ['lemmas']
 
     def process(self, document):
         if not document['palavras_raw_ran']:
@@ -29,6 +29,8 @@ NOUNPHRASE_SCRIPT = 'bin/extract_np.pl'
 
 class NounPhrase(PyPLNTask):
     """Noun phrase extractor"""
+    requires = ['palavras_raw_ran', 'palavras_raw']
+    provides = ['noun_phrases']
 
     def process(self, document):
         if not document['palavras_raw_ran']:
@@ -21,6 +21,7 @@ import os
 import subprocess
 
 from pypln.backend.celery_task import PyPLNTask
+from pypln.backend.texts import document_text
 
 # The machine's locale should be set to pt_BR.UTF-8 during palavras'
 # installation process.
@@ -32,12 +33,14 @@ def palavras_installed():
     return os.path.exists(BASE_PARSER)
 
 class PalavrasRaw(PyPLNTask):
+    requires = ['language', 'text', 'text_file_id']
+    provides = ['palavras_raw', 'palavras_raw_ran']
 
     def process(self, document):
         if document['language'] != 'pt' or not palavras_installed():
             return {'palavras_raw_ran': False}
 
-        text = document['text']
+        text = document_text(document)
 
         # For some reason, in some pypln installations the document['text'] is
         # not always unicode as it should be. This may be due to errors during
@@ -409,6 +409,8 @@ angle_brackets_contents = re.compile('(<[a-zA-Z]*>)')
 
 class SemanticTagger(PyPLNTask):
     """Semantic Tagger"""
+    requires = ['palavras_raw_ran', 'palavras_raw']
+    provides = ['semantic_tags']
 
     def process(self, document):
         if not document['palavras_raw_ran']:
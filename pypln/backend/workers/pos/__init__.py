@@ -21,7 +21,10 @@
 import en_nltk
 import pt_palavras
 from pypln.backend.workers.palavras_raw import palavras_installed
-from pypln.backend.celery_task import PyPLNTask
+from pypln.backend.celery_task import PyPLNTask, get_document_collection
+from pypln.backend.packing import unpack_spans
+from pypln.backend.texts import document_text
+from pypln.backend.tokens import TOKEN_FIELDS, document_tokens
 
 
 MAPPING = {
@@ -40,15 +43,48 @@ def put_offset(text, tagged_text):
         position = token_position + len(token) - 1
     return result
 
+def fetch_text(document):
+    """
+    Returns the text of the document, fetching it from the database if it
+    is not in the dictionary.
+    """
+    if 'text' not in document and 'text_file_id' not in document:
+        document = get_document_collection().find_one(
+                {'_id': document['_id']}, ['text', 'text_file_id'])
+    text = document_text(document)
+    if not isinstance(text, unicode):
+        text = text.decode('utf-8')
+    return text
+
+def put_offset_from_spans(tagged_text, spans):
+    return [(token, classification, start) for (token, classification),
+            (start, end) in zip(tagged_text, spans)]
+
 class POS(PyPLNTask):
+    """
+    Tags the tokens of the document with their part of speech, and gives the
+    position of each one in the text. When the tagger keeps the tokens of
+    the Tokenizer, their positions are taken from `token_spans`; otherwise
+    (like with palavras, which tokenizes the text itself) they are searched
+    in the text, which is only fetched in that case.
+    """
+    version = 2
+    requires = ['language', 'token_spans', 'palavras_raw'] + TOKEN_FIELDS
+    provides = ['pos', 'tagset']
+
     def process(self, document):
         tagged_text_with_offset = None
         tagset = None
         language = document['language']
         if language in MAPPING:
-            tagset, tagged_text = MAPPING[language](document)
-            text = document['text']
-            if not isinstance(text, unicode):
-                text = text.decode('utf-8')
-            tagged_text_with_offset = put_offset(text, tagged_text)
+            tokens = document_tokens(document)
+            tagset, tagged_text = MAPPING[language](document, tokens)
+            spans = document.get('token_spans')
+            if spans is not None and [token for token, classification in
+                    tagged_text] == tokens:
+                tagged_text_with_offset = put_offset_from_spans(tagged_text,
+                        unpack_spans(spans))
+            else:
+                tagged_text_with_offset = put_offset(fetch_text(document),
+                        tagged_text)
         return {'pos': tagged_text_with_offset, 'tagset': tagset}
@@ -17,7 +17,23 @@
 # You should have received a copy of the GNU General Public License
 # along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
 
-from nltk import pos_tag
+from nltk.tag.perceptron import PerceptronTagger
 
-def pos(document):
-    return 'en-nltk', pos_tag(document['tokens'])
+from pypln.backend.tokens import document_tokens
+
+_tagger = None
+
+def get_tagger():
+    """
+    Returns the tagger used by `nltk.pos_tag`. Loading its model is slow, so
+    it is only done once per process (`nltk.pos_tag` loads it on every call).
+    """
+    global _tagger
+    if _tagger is None:
+        _tagger = PerceptronTagger()
+    return _tagger
+
+def pos(document, tokens=None):
+    if tokens is None:
+        tokens = document_tokens(document)
+    return 'en-nltk', get_tagger().tag(tokens)
@@ -43,7 +43,8 @@ WORD_CLASSES = {
 }
 
 
-def pos(document):
+def pos(document, tokens=None):
+    # palavras tokenizes the text itself, so `tokens` is not used.
     if 'palavras_raw' not in document:
         return u'', []
 
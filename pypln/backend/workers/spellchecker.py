@@ -21,11 +21,15 @@
 import enchant
 from enchant.checker import SpellChecker
 from pypln.backend.celery_task import PyPLNTask
+from pypln.backend.texts import document_text
 
 class SpellingChecker(PyPLNTask):
     """
     This worker performs spellchecking in the plain text of a document
     """
+    requires = ['language', 'text', 'text_file_id']
+    provides = ['spelling_errors']
+
     def __init__(self):
         # This method is only called once per process, but that is no problem
         # since the enchant languange list should not change. Don't use this
@@ -38,7 +42,7 @@ class SpellingChecker(PyPLNTask):
         #TODO: this worker may be enhanced by also checking the errors against an specific vocabulary supplied with the document
         try:
             checker = self.checkers[document['language']]
-            checker.set_text(document['text'])
+            checker.set_text(document_text(document))
             errors = [[e.word, e.wordpos, e.suggest()] for e in checker]
         except KeyError:
             errors = None
@@ -20,6 +20,7 @@
 from collections import Counter
 
 from pypln.backend.celery_task import PyPLNTask
+from pypln.backend.tokens import SENTENCE_FIELDS, document_sentences
 
 
 def _get_momenta(distribution):
@@ -43,10 +44,16 @@ def _histogram(freqdist):
     return sorted(counter.most_common())
 
 class Statistics(PyPLNTask):
+    requires = ['freqdist'] + SENTENCE_FIELDS
+    provides = ['momentum_1', 'momentum_2', 'momentum_3', 'momentum_4',
+            'repertoire', 'average_sentence_length',
+            'average_sentence_repertoire']
 
     def process(self, document):
         freqdist = document['freqdist'] # eg: [('word', 100), ('other', 97)]
-        sentences = document['sentences'] # eg: [['1st', 'sentence.'], ['2nd!']]
+        # eg: [['1st', 'sentence.'], ['2nd!']] (or the ids of the tokens,
+        # which are enough to count them).
+        sentences = document_sentences(document, materialize=False)
         momenta = _get_momenta(_histogram(freqdist))
         total_tokens = float(sum(dict(freqdist).values()))
         if total_tokens == 0:
@@ -16,15 +16,180 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
-from nltk import word_tokenize, sent_tokenize
+from multiprocessing import Pool, current_process
 
+from celery.signals import worker_process_init
+from nltk import data
+try:
+    # The tokenizer `word_tokenize` uses for each sentence since NLTK 3.4.
+    from nltk.tokenize import NLTKWordTokenizer as WordTokenizer
+except ImportError:
+    from nltk.tokenize import TreebankWordTokenizer as WordTokenizer
+
+from pypln.backend import config
 from pypln.backend.celery_task import PyPLNTask
+from pypln.backend.packing import pack_spans
+from pypln.backend.texts import document_text
+from pypln.backend.tokens import compact_tokens
+
+
+# Like the MongoClient (see `pypln.backend.celery_task`), the pool used to
+# tokenize large texts is created the first time it is needed in each
+# process, and then reused.
+_pool = None
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = Pool(config.TOKENIZER_PROCESSES)
+    return _pool
+
+@worker_process_init.connect
+def drop_pool(**kwargs):
+    # A pool inherited from the parent process does not work in the child.
+    global _pool
+    _pool = None
+
+# `word_tokenize` splits the text in sentences again before tokenizing them,
+# so the sentences found by `tokenize` are given to its word tokenizer.
+word_tokenizer = WordTokenizer()
+
+# Treebank tokenization turns double quotes into `` or '' (and '' into ``
+# when it opens a quotation).
+QUOTES = {'``': ['``', "''", '"'], "''": ["''", '"']}
+
+def get_sentence_tokenizer():
+    # The tokenizer `sent_tokenize` uses (loaded once, by `nltk.data`).
+    return data.load('tokenizers/punkt/english.pickle')
+
+def align_tokens(text, tokens, start=0, end=None):
+    """
+    Returns the `(start, end)` span of each token in `text`, looking for
+    them in order between `start` and `end`. A token that is not found gets
+    an empty span at the end of the previous one.
+    """
+    if end is None:
+        end = len(text)
+    spans = []
+    position = start
+    for token in tokens:
+        matches = [(text.find(candidate, position, end), candidate)
+                for candidate in QUOTES.get(token, [token])]
+        matches = [match for match in matches if match[0] != -1]
+        if not matches:
+            spans.append((position, position))
+            continue
+        token_start, candidate = min(matches)
+        position = token_start + len(candidate)
+        spans.append((token_start, position))
+    return spans
+
+def tokenize(text, offset=0):
+    """
+    Returns the sentences of the text (as lists of tokens) and the spans of
+    its tokens and sentences, shifted by `offset`.
+    """
+    sentence_spans = list(get_sentence_tokenizer().span_tokenize(text))
+    sentences = []
+    token_spans = []
+    for start, end in sentence_spans:
+        sentence = word_tokenizer.tokenize(text[start:end])
+        sentences.append(sentence)
+        token_spans.extend(align_tokens(text, sentence, start, end))
+    if offset:
+        token_spans = [(start + offset, end + offset)
+                for start, end in token_spans]
+        sentence_spans = [(start + offset, end + offset)
+                for start, end in sentence_spans]
+    return sentences, token_spans, sentence_spans
+
+def tokenize_chunk(chunk):
+    # Receives a `(text, offset)` pair, since `Pool.map` passes only one
+    # argument.
+    return tokenize(*chunk)
+
+def paragraph_chunks(text, size):
+    """
+    Returns the `(start, end)` of consecutive chunks of the text with about
+    `size` characters, ending after a paragraph break. A paragraph longer
+    than `size` is a chunk on its own.
+    """
+    chunks = []
+    start = 0
+    while len(text) - start > size:
+        end = text.rfind('\n\n', start, start + size)
+        if end == -1:
+            end = text.find('\n\n', start + size)
+            if end == -1:
+                break
+        chunks.append((start, end + 2))
+        start = end + 2
+    chunks.append((start, len(text)))
+    return chunks
+
+def can_start_processes():
+    # Daemonic processes (like the children of Celery's prefork pool) are
+    # not allowed to have children.
+    return not current_process().daemon
+
+def tokenize_in_parallel(text):
+    """
+    Tokenizes the paragraph chunks of the text (see `paragraph_chunks`) in
+    a process pool (see `get_pool`) and joins their results, like `tokenize`
+    does for a whole text. A text that is a single chunk is tokenized in
+    this process.
+    """
+    chunks = [(text[start:end], start) for start, end in
+            paragraph_chunks(text, config.TOKENIZER_CHUNK_SIZE)]
+    if len(chunks) == 1:
+        return tokenize(text)
+    results = get_pool().map(tokenize_chunk, chunks)
+    sentences = []
+    token_spans = []
+    sentence_spans = []
+    for chunk_sentences, chunk_token_spans, chunk_sentence_spans in results:
+        sentences.extend(chunk_sentences)
+        token_spans.extend(chunk_token_spans)
+        sentence_spans.extend(chunk_sentence_spans)
+    return sentences, token_spans, sentence_spans
 
 
 class Tokenizer(PyPLNTask):
+    """
+    Splits the text in sentences and tokenizes each one of them. The tokens
+    of the whole text are the tokens of its sentences, which is also what
+    `word_tokenize` returns for it, so the text is only tokenized once.
+
+    The character spans of the tokens and of the sentences are stored
+    packed (see `pypln.backend.packing`) in `token_spans` and
+    `sentence_spans`. Very large texts are tokenized by paragraphs in
+    parallel, when possible (see `config.TOKENIZER_PARALLEL_MIN_SIZE`).
+
+    With `config.COMPACT_TOKENS`, the tokens and sentences are stored as
+    token ids (see `pypln.backend.tokens`).
+    """
+    version = 2
+    requires = ['text', 'text_file_id']
+    provides = ['tokens', 'sentences', 'vocabulary', 'token_ids',
+            'sentence_offsets', 'token_spans', 'sentence_spans']
+    settings = ['TOKENIZER_PARALLEL_MIN_SIZE', 'TOKENIZER_CHUNK_SIZE',
+            'COMPACT_TOKENS']
 
     def process(self, document):
-        text = document['text']
-        tokens = word_tokenize(text)
-        sentences = [word_tokenize(sent) for sent in sent_tokenize(text)]
-        return {'tokens': tokens, 'sentences': sentences}
+        text = document_text(document)
+        if config.TOKENIZER_PARALLEL_MIN_SIZE and \
+                len(text) >= config.TOKENIZER_PARALLEL_MIN_SIZE and \
+                config.TOKENIZER_PROCESSES > 1 and can_start_processes():
+            sentences, token_spans, sentence_spans = tokenize_in_parallel(text)
+        else:
+            sentences, token_spans, sentence_spans = tokenize(text)
+        if config.COMPACT_TOKENS:
+            result = compact_tokens(sentences)
+        else:
+            tokens = [token for sentence in sentences for token in sentence]
+            result = {'tokens': tokens, 'sentences': sentences,
+                    'vocabulary': None, 'token_ids': None,
+                    'sentence_offsets': None}
+        result.update({'token_spans': pack_spans(token_spans),
+            'sentence_spans': pack_spans(sentence_spans)})
+        return result
@@ -22,11 +22,14 @@ import nltk
 from nltk.collocations import TrigramCollocationFinder
 from collections import defaultdict
 from pypln.backend.celery_task import PyPLNTask
+from pypln.backend.tokens import TOKEN_FIELDS, document_tokens
 
 
 
 class Trigrams(PyPLNTask):
     """Create a NLTK trigram finder and returns a table in JSON format"""
+    requires = TOKEN_FIELDS
+    provides = ['trigram_rank', 'metrics']
 
     def process(self, document):
         trigram_measures = nltk.collocations.TrigramAssocMeasures()
@@ -38,7 +41,8 @@ class Trigrams(PyPLNTask):
                    'poisson_stirling',
                    'raw_freq',
                    'student_t']
-        trigram_finder = TrigramCollocationFinder.from_words(document['tokens'])
+        trigram_finder = TrigramCollocationFinder.from_words(
+                document_tokens(document))
         tr = defaultdict(lambda: [])
         for m in metrics:
             for res in trigram_finder.score_ngrams(getattr(trigram_measures,m)):
@@ -27,14 +27,28 @@ from wordcloud import make_wordcloud
 
 from pypln.backend.celery_task import PyPLNTask
 
+_stopwords = {}
+
+def get_stopwords(lang):
+    """
+    Returns the set of stopwords for the language. NLTK reads the stopwords
+    file every time they are requested, so they are kept once loaded.
+    """
+    if lang not in _stopwords:
+        long_name = {'en': 'english', 'pt': 'portuguese'}
+        stopwords = set(string.punctuation)
+        if lang in long_name:
+            stopwords.update(nltk.corpus.stopwords.words(long_name[lang]))
+        _stopwords[lang] = stopwords
+    return _stopwords[lang]
+
 def filter_stopwords(fdist, lang):
-    long_name = {'en': 'english', 'pt': 'portuguese'}
-    stopwords =  list(string.punctuation)
-    if lang in long_name:
-        stopwords += nltk.corpus.stopwords.words(long_name[lang])
+    stopwords = get_stopwords(lang)
     return filter(lambda pair: pair[0].lower() not in stopwords, fdist)
 
 class WordCloud(PyPLNTask):
+    requires = ['freqdist', 'language']
+    provides = ['wordcloud']
 
     def process(self, document):
         fdist = filter_stopwords(document['freqdist'], document['language'])
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# Copyright 2015 NAMD-EMAP-FGV
+#
+# This file is part of PyPLN. You can get more information at: http://pypln.org/.
+#
+# PyPLN is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyPLN is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Compares the running time of `frequency_distribution` with the FreqDist
+implementation it replaced (which counts every distinct token with
+`list.count`, so it is quadratic), checking both give the same counts. The
+tokens are drawn from a vocabulary with a Zipf-like distribution, like the
+words of a text. The old implementation is only run on inputs of up to
+LEGACY_MAX_TOKENS tokens, since it takes minutes on larger ones.
+"""
+from __future__ import print_function
+import random
+from timeit import default_timer
+
+from pypln.backend.workers.freqdist import frequency_distribution
+
+
+LEGACY_MAX_TOKENS = 10 ** 5
+
+def legacy_frequency_distribution(tokens):
+    frequency_distribution = {token: tokens.count(token) \
+                              for token in set(tokens)}
+    fd = frequency_distribution.items()
+    fd.sort(lambda x, y: cmp(y[1], x[1]))
+    return fd
+
+def generate_tokens(size, vocabulary_size=50000):
+    random_generator = random.Random(42)
+    vocabulary = ['word{}'.format(index) for index in range(vocabulary_size)]
+    # The weight of the word with rank r is 1 / r.
+    cumulative_weights = []
+    total = 0.0
+    for rank in range(1, vocabulary_size + 1):
+        total += 1.0 / rank
+        cumulative_weights.append(total)
+    tokens = []
+    for _ in range(size):
+        position = random_generator.random() * total
+        low, high = 0, vocabulary_size - 1
+        while low < high:
+            middle = (low + high) // 2
+            if cumulative_weights[middle] < position:
+                low = middle + 1
+            else:
+                high = middle
+        tokens.append(vocabulary[low])
+    return tokens
+
+def measure(function, *args):
+    start = default_timer()
+    result = function(*args)
+    return default_timer() - start, result
+
+def main():
+    for size in (10 ** 4, 10 ** 5, 10 ** 6):
+        tokens = generate_tokens(size)
+        new_time, fd = measure(frequency_distribution, tokens)
+        top_time, top = measure(frequency_distribution, tokens, 100)
+        line = '{} tokens ({} distinct): frequency_distribution {:.3f}s, ' \
+                'top 100 {:.3f}s'.format(size, len(fd), new_time, top_time)
+        if size <= LEGACY_MAX_TOKENS:
+            legacy_time, legacy_fd = measure(legacy_frequency_distribution,
+                    tokens)
+            # The legacy implementation breaks ties in no particular order.
+            same = sorted(legacy_fd) == sorted(fd)
+            line += ', legacy {:.3f}s{}'.format(legacy_time,
+                    '' if same else ' (DIFFERENT OUTPUT)')
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# Copyright 2015 NAMD-EMAP-FGV
+#
+# This file is part of PyPLN. You can get more information at: http://pypln.org/.
+#
+# PyPLN is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyPLN is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Compares the running time of `parse_html` with the implementation it
+replaced (which is quadratic on the number of tags), checking both give the
+same text. Uses the HTML files given in the command line or, if there are
+none, generated pages of increasing size.
+"""
+from __future__ import print_function
+import sys
+from timeit import default_timer
+
+from pypln.backend.workers.extractor import (breakline_tags, clean,
+        double_breakline, parse_html, regexp_comment, regexp_tags)
+
+
+def legacy_parse_html(html, remove_tags=None, remove_inside=None,
+                      replace_space_with=' ', replace_newline_with='\n'):
+    html = regexp_comment.sub('', html.replace('\n', ''))
+    data = regexp_tags.split(html)
+    content_between = data[::3]
+    complete_tags = data[1::3]
+    tag_names = [x.lower() for x in data[2::3]]
+    for index, tag_name in enumerate(tag_names):
+        if not tag_name.strip():
+            continue
+        search_tag = tag_name
+        if tag_name and tag_name[0] == '/':
+            search_tag = tag_name[1:]
+        if remove_tags and search_tag not in remove_inside:
+            if tag_name in breakline_tags:
+                if search_tag in double_breakline:
+                    complete_tags[index] = 2 * replace_newline_with
+                else:
+                    complete_tags[index] = replace_newline_with
+            else:
+                complete_tags[index] = replace_space_with
+        if remove_inside and tag_name in remove_inside:
+            remove_to = tag_names.index('/' + tag_name, index)
+            total_to_remove = remove_to - index + 1
+            complete_tags[index:remove_to + 1] = [''] * total_to_remove
+            content_between[index + 2:remove_to + 1] = \
+                    [''] * (total_to_remove - 2)
+            content_between[index + 1] = '\n'
+    complete_tags.append('')
+    result = ''.join(sum(zip(content_between, complete_tags), tuple()))
+    return clean(result)
+
+def parse_and_clean(html, *args):
+    return clean(parse_html(html, *args))
+
+def generate_page(paragraphs):
+    block = ('<div class="post"><h2>Title</h2>\n'
+             '<p>Some <b>text</b> with <a href="/link">a link</a>.</p>\n'
+             '<!-- a comment -->\n'
+             '<script type="text/javascript">var a = "<div>";</script>\n'
+             '<table><tr><td>cell</td><td>cell</td></tr></table></div>\n')
+    return '<html><head><style>p { color: red; }</style></head><body>' + \
+            block * paragraphs + '</body></html>'
+
+def measure(function, html):
+    start = default_timer()
+    result = function(html, True, ['script', 'style'])
+    return default_timer() - start, result
+
+def main():
+    if len(sys.argv) > 1:
+        pages = [(filename, open(filename).read())
+                 for filename in sys.argv[1:]]
+    else:
+        pages = [('{} blocks'.format(size), generate_page(size))
+                 for size in (100, 1000, 5000)]
+    for name, html in pages:
+        legacy_time, legacy_text = measure(legacy_parse_html, html)
+        new_time, new_text = measure(parse_and_clean, html)
+        print('{} ({} bytes): legacy {:.3f}s, parse_html {:.3f}s{}'.format(
+            name, len(html), legacy_time, new_time,
+            '' if legacy_text == new_text else ' (DIFFERENT OUTPUT)'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# Copyright 2015 NAMD-EMAP-FGV
+#
+# This file is part of PyPLN. You can get more information at: http://pypln.org/.
+#
+# PyPLN is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyPLN is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Deletes the texts stored in GridFS (see `pypln.backend.texts`) that no
+analysis document and no cached Extractor result refer to anymore, like the
+previous text of a document that was extracted again. Texts stored less than
+a day ago are kept, since the document of an extraction that is still
+running may not refer to its text yet.
+"""
+from __future__ import print_function
+from datetime import datetime, timedelta
+
+from pypln.backend import config
+from pypln.backend.celery_task import get_database, get_document_collection
+from pypln.backend.texts import delete_text_file
+
+
+def referenced_text_file_ids():
+    database = get_database()
+    referenced = set(document['text_file_id'] for document in
+            get_document_collection().find({'text_file_id': {'$ne': None}},
+                ['text_file_id']))
+    # Duplicate uploads get the `text_file_id` of a cached result.
+    for collection in (config.MONGODB_CACHE_COLLECTION,
+            config.MONGODB_EXTRACTOR_CACHE_COLLECTION):
+        for entry in database[collection].find(
+                {'value.text_file_id': {'$ne': None}},
+                ['value.text_file_id']):
+            referenced.add(entry['value']['text_file_id'])
+    return referenced
+
+
+def main():
+    stored_before = datetime.utcnow() - timedelta(days=1)
+    referenced = referenced_text_file_ids()
+    files = get_database()[config.MONGODB_TEXTS_COLLECTION + '.files']
+    deleted = 0
+    for text_file in files.find({'uploadDate': {'$lt': stored_before}},
+            ['_id']):
+        if text_file['_id'] not in referenced:
+            delete_text_file(text_file['_id'])
+            deleted += 1
+    print('Deleted {} unused texts.'.format(deleted))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# Copyright 2015 NAMD-EMAP-FGV
+#
+# This file is part of PyPLN. You can get more information at: http://pypln.org/.
+#
+# PyPLN is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyPLN is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Moves the base64 `contents` of the analysis documents to the upload store
+(see `pypln.backend.uploads`), leaving only their digest in the document.
+"""
+from __future__ import print_function
+import base64
+
+from pypln.backend.celery_task import get_document_collection
+from pypln.backend.uploads import store_upload
+
+
+def main():
+    documents = get_document_collection()
+    moved = 0
+    for document in documents.find({'contents': {'$exists': True}},
+            ['contents', 'filename']):
+        digest = store_upload(base64.b64decode(document['contents']),
+                document.get('filename'))
+        documents.update({'_id': document['_id']},
+                {'$set': {'contents_digest': digest},
+                 '$unset': {'contents': 1}})
+        moved += 1
+    print('Moved the contents of {} documents.'.format(moved))
+
+
+if __name__ == '__main__':
+    main()
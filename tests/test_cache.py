@@ -0,0 +1,96 @@
+# coding: utf-8
+#
+# Copyright 2015 NAMD-EMAP-FGV
+#
+# This file is part of PyPLN. You can get more information at: http://pypln.org/.
+#
+# PyPLN is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyPLN is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
+from datetime import datetime, timedelta
+
+from pypln.backend.cache import ResultCache
+from utils import TaskTest
+
+class TestResultCache(TaskTest):
+    def setUp(self):
+        super(TestResultCache, self).setUp()
+        self.cache_collection = self.db['test_result_cache']
+        self.cache = ResultCache(self.cache_collection, max_entries=2,
+                evict_every=1)
+
+    def tearDown(self):
+        super(TestResultCache, self).tearDown()
+        self.cache_collection.drop()
+
+    def test_get_should_return_the_value_that_was_set(self):
+        self.cache.set('key', {'result': 'value'})
+        self.assertEqual(self.cache.get('key'), {'result': 'value'})
+
+    def test_get_should_return_none_for_missing_keys(self):
+        self.assertIsNone(self.cache.get('missing'))
+
+    def test_hits_and_misses_should_be_counted(self):
+        self.cache.set('key', {'result': 'value'})
+        self.cache.get('key')
+        self.cache.get('key')
+        self.cache.get('missing')
+        self.assertEqual(self.cache.hits, 2)
+        self.assertEqual(self.cache.misses, 1)
+        stats = self.cache.stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 1)
+        self.assertAlmostEqual(stats['hit_rate'], 2 / 3.0)
+
+    def test_hits_and_misses_should_be_flushed_in_batches(self):
+        cache = ResultCache(self.cache_collection, max_entries=2,
+                flush_stats_every=2)
+        cache.get('missing')
+        self.assertIsNone(self.cache_collection.find_one(
+            {'_id': ResultCache.STATS_ID}))
+        cache.get('missing')
+        stats = self.cache_collection.find_one({'_id': ResultCache.STATS_ID})
+        self.assertEqual(stats['misses'], 2)
+
+    def test_least_recently_used_entries_should_be_evicted(self):
+        self.cache.set('first', {'result': 1})
+        self.cache.set('second', {'result': 2})
+        self.cache.get('first')
+        self.cache.set('third', {'result': 3})
+        self.assertIsNone(self.cache.get('second'))
+        self.assertEqual(self.cache.get('first'), {'result': 1})
+        self.assertEqual(self.cache.get('third'), {'result': 3})
+
+    def test_eviction_should_only_be_checked_every_evict_every_sets(self):
+        cache = ResultCache(self.cache_collection, max_entries=1,
+                evict_every=3)
+        cache.set('first', {'result': 1})
+        cache.set('second', {'result': 2})
+        self.assertEqual(self.cache_collection.find(
+            {'last_used': {'$exists': True}}).count(), 2)
+        cache.set('third', {'result': 3})
+        self.assertEqual(self.cache_collection.find(
+            {'last_used': {'$exists': True}}).count(), 1)
+        self.assertEqual(cache.get('third'), {'result': 3})
+
+    def test_expired_entries_should_be_ignored(self):
+        cache = ResultCache(self.cache_collection, max_entries=2, ttl=60)
+        cache.set('key', {'result': 'value'})
+        self.assertEqual(cache.get('key'), {'result': 'value'})
+        self.cache_collection.update({'_id': 'key'}, {'$set':
+            {'expires_at': datetime.utcnow() - timedelta(seconds=1)}})
+        self.assertIsNone(cache.get('key'))
+
+    def test_entries_should_be_removed_by_a_ttl_index(self):
+        ResultCache(self.cache_collection, max_entries=2, ttl=60)
+        indexes = self.cache_collection.index_information()
+        self.assertEqual(indexes['expires_at_1']['expireAfterSeconds'], 0)
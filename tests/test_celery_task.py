@@ -16,13 +16,37 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
+from bson import ObjectId
+from mock import patch
+
+from pypln.backend import config
+from pypln.backend.cache import ResultCache
 from pypln.backend.celery_task import PyPLNTask
+from pypln.backend.workers import WORKER_METADATA, WorkerMetadata
 from utils import TaskTest
 
 class FakeTask(PyPLNTask):
     def process(self, document):
         return {'result': document['input']}
 
+class FakeTaskWithRequires(PyPLNTask):
+    requires = ['input']
+
+    def process(self, document):
+        return {'result': sorted(document.keys())}
+
+class CountingTask(PyPLNTask):
+    requires = ['input']
+    calls = 0
+    setting = 'first'
+
+    def fingerprint_config(self):
+        return {'setting': CountingTask.setting}
+
+    def process(self, document):
+        CountingTask.calls += 1
+        return {'result': document['input']}
+
 class TestCeleryTask(TaskTest):
     def test_task_should_get_the_correct_document(self):
         """This is a regression test. PyPLNTask was not filtering by _id. It
@@ -37,3 +61,148 @@ class TestCeleryTask(TaskTest):
         refreshed_doc = self.collection.find_one({'_id': correct_doc_id})
 
         self.assertEqual(refreshed_doc['result'], 'correct')
+
+    def test_task_should_fetch_only_required_fields(self):
+        doc_id = self.collection.insert({'input': 'correct',
+            'contents': 'large blob'}, w=1)
+
+        FakeTaskWithRequires().delay(doc_id)
+
+        refreshed_doc = self.collection.find_one({'_id': doc_id})
+
+        self.assertEqual(refreshed_doc['result'], ['_id', 'input'])
+
+    def test_task_should_process_a_list_of_documents_as_a_batch(self):
+        doc_ids = [self.collection.insert({'input': 'first'}, w=1),
+                self.collection.insert({'input': 'second'}, w=1)]
+        not_in_batch_id = self.collection.insert({'input': 'third'}, w=1)
+
+        result = FakeTask().delay(doc_ids)
+
+        self.assertEqual(result.get(), doc_ids)
+        self.assertEqual(self.collection.find_one({'_id': doc_ids[0]})['result'],
+                'first')
+        self.assertEqual(self.collection.find_one({'_id': doc_ids[1]})['result'],
+                'second')
+        self.assertNotIn('result',
+                self.collection.find_one({'_id': not_in_batch_id}))
+
+    def test_missing_documents_should_not_stop_the_rest_of_a_batch(self):
+        doc_id = self.collection.insert({'input': 'first'}, w=1)
+        missing_id = ObjectId()
+
+        result = FakeTask().delay([missing_id, doc_id])
+
+        self.assertEqual(result.get(), [doc_id])
+        self.assertEqual(self.collection.find_one({'_id': doc_id})['result'],
+                'first')
+
+    def test_duplicate_uploads_should_get_results_from_the_cache(self):
+        cache = ResultCache(self.db['test_result_cache'], max_entries=10)
+        self.addCleanup(self.db['test_result_cache'].drop)
+        first_id = self.collection.insert({'input': 'first',
+            'contents_digest': 'deadbeef'}, w=1)
+        duplicate_id = self.collection.insert({'input': 'duplicate',
+            'contents_digest': 'deadbeef'}, w=1)
+        CountingTask.calls = 0
+
+        with patch('pypln.backend.celery_task.get_result_cache',
+                return_value=cache):
+            CountingTask().delay(first_id)
+            CountingTask().delay(duplicate_id)
+
+        self.assertEqual(CountingTask.calls, 1)
+        self.assertEqual(cache.hits, 1)
+        duplicate_doc = self.collection.find_one({'_id': duplicate_id})
+        self.assertEqual(duplicate_doc['result'], 'first')
+
+    @patch.object(config, 'SKIP_UNCHANGED_INPUTS', True)
+    def test_task_should_not_process_again_if_inputs_did_not_change(self):
+        doc_id = self.collection.insert({'input': 'first'}, w=1)
+        CountingTask.calls = 0
+
+        CountingTask().delay(doc_id)
+        CountingTask().delay(doc_id)
+        self.assertEqual(CountingTask.calls, 1)
+
+        self.collection.update({'_id': doc_id}, {'$set': {'input': 'second'}})
+        CountingTask().delay(doc_id)
+        self.assertEqual(CountingTask.calls, 2)
+        refreshed_doc = self.collection.find_one({'_id': doc_id})
+        self.assertEqual(refreshed_doc['result'], 'second')
+        self.assertIn('CountingTask', refreshed_doc['fingerprints'])
+
+    @patch.object(config, 'SKIP_UNCHANGED_INPUTS', True)
+    def test_task_should_process_again_if_version_changed(self):
+        doc_id = self.collection.insert({'input': 'first'}, w=1)
+        CountingTask.calls = 0
+
+        CountingTask().delay(doc_id)
+        with patch.object(CountingTask, 'version', 2):
+            CountingTask().delay(doc_id)
+
+        self.assertEqual(CountingTask.calls, 2)
+
+    @patch.object(config, 'SKIP_UNCHANGED_INPUTS', True)
+    def test_task_should_process_again_if_settings_changed(self):
+        doc_id = self.collection.insert({'input': 'first'}, w=1)
+        CountingTask.calls = 0
+
+        CountingTask().delay(doc_id)
+        with patch.object(CountingTask, 'setting', 'second'):
+            CountingTask().delay(doc_id)
+
+        self.assertEqual(CountingTask.calls, 2)
+
+    def test_task_should_always_process_if_skipping_is_disabled(self):
+        doc_id = self.collection.insert({'input': 'first'}, w=1)
+        CountingTask.calls = 0
+
+        with patch.object(config, 'SKIP_UNCHANGED_INPUTS', False):
+            CountingTask().delay(doc_id)
+            CountingTask().delay(doc_id)
+
+        self.assertEqual(CountingTask.calls, 2)
+        refreshed_doc = self.collection.find_one({'_id': doc_id})
+        self.assertNotIn('fingerprints', refreshed_doc)
+
+    def test_cached_results_should_not_be_used_if_settings_changed(self):
+        cache = ResultCache(self.db['test_result_cache'], max_entries=10)
+        self.addCleanup(self.db['test_result_cache'].drop)
+        first_id = self.collection.insert({'input': 'first',
+            'contents_digest': 'deadbeef'}, w=1)
+        duplicate_id = self.collection.insert({'input': 'duplicate',
+            'contents_digest': 'deadbeef'}, w=1)
+        CountingTask.calls = 0
+
+        with patch('pypln.backend.celery_task.get_result_cache',
+                return_value=cache):
+            CountingTask().delay(first_id)
+            with patch.object(CountingTask, 'setting', 'second'):
+                CountingTask().delay(duplicate_id)
+
+        self.assertEqual(CountingTask.calls, 2)
+
+    def test_cached_results_should_not_be_used_if_upstream_changed(self):
+        cache = ResultCache(self.db['test_result_cache'], max_entries=10)
+        self.addCleanup(self.db['test_result_cache'].drop)
+        first_id = self.collection.insert({'input': 'first',
+            'contents_digest': 'deadbeef'}, w=1)
+        duplicate_id = self.collection.insert({'input': 'duplicate',
+            'contents_digest': 'deadbeef'}, w=1)
+        CountingTask.calls = 0
+        input_task = WorkerMetadata([], ['input'], 1, [])
+
+        with patch('pypln.backend.celery_task.get_result_cache',
+                return_value=cache), \
+                patch.dict(WORKER_METADATA, {'InputTask': input_task}):
+            CountingTask().delay(first_id)
+            WORKER_METADATA['InputTask'] = input_task._replace(version=2)
+            CountingTask().delay(duplicate_id)
+
+        self.assertEqual(CountingTask.calls, 2)
+
+    def test_explicit_upstream_versions_should_be_used(self):
+        with patch.object(CountingTask, 'upstream_versions', {'Input': 3}):
+            self.assertEqual(CountingTask().get_upstream_versions(),
+                    {'Input': 3})
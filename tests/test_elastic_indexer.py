@@ -10,6 +10,7 @@ __docformat__ = 'restructuredtext en'
 
 from mock import patch
 
+from pypln.backend.tokens import compact_tokens
 from pypln.backend.workers.elastic_indexer import ElasticIndexer
 from .utils import TaskTest
 from elasticsearch import Elasticsearch
@@ -64,3 +65,20 @@ class TestIndexer(TaskTest):
         doc.pop('_id')
         ES.index.assert_called_with(body=doc, id=doc['file_id'],
                 doc_type=doc_type, index=index_name)
+
+    @patch('pypln.backend.workers.elastic_indexer.ES')
+    def test_compact_tokens_should_be_indexed_as_tokens(self, ES):
+        sentences = [[u'The', u'sky', u'is', u'blue', u'.'],
+                [u'The', u'sun', u'.']]
+        doc = compact_tokens(sentences)
+        doc.update({'index_name': 'test_pypln', 'doc_type': 'document',
+            'file_id': 'deadbeef', 'text': u'The sky is blue. The sun.'})
+
+        doc_id = self.collection.insert(doc, w=1)
+        ElasticIndexer().delay(doc_id)
+        body = ES.index.call_args[1]['body']
+        self.assertEqual(body['sentences'], sentences)
+        self.assertEqual(body['tokens'],
+                [token for sentence in sentences for token in sentence])
+        for key in ('vocabulary', 'token_ids', 'sentence_offsets'):
+            self.assertNotIn(key, body)
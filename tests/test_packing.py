@@ -0,0 +1,38 @@
+# coding: utf-8
+#
+# Copyright 2015 NAMD-EMAP-FGV
+#
+# This file is part of PyPLN. You can get more information at: http://pypln.org/.
+#
+# PyPLN is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyPLN is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
+import unittest
+
+from bson.binary import Binary
+
+from pypln.backend.packing import (pack_ints, pack_spans, unpack_ints,
+        unpack_spans)
+
+
+class TestPacking(unittest.TestCase):
+    def test_ints_should_be_packed_as_little_endian_32_bit_integers(self):
+        packed = pack_ints([1, 256, 2 ** 32 - 1])
+        self.assertIsInstance(packed, Binary)
+        self.assertEqual(str(packed),
+                '\x01\x00\x00\x00\x00\x01\x00\x00\xff\xff\xff\xff')
+        self.assertEqual(unpack_ints(packed), [1, 256, 2 ** 32 - 1])
+
+    def test_spans_should_be_unpacked_as_they_were_packed(self):
+        spans = [(0, 3), (4, 7), (7, 8)]
+        self.assertEqual(unpack_spans(pack_spans(spans)), spans)
+        self.assertEqual(unpack_spans(pack_spans([])), [])
@@ -0,0 +1,168 @@
+# coding: utf-8
+#
+# Copyright 2015 NAMD-EMAP-FGV
+#
+# This file is part of PyPLN. You can get more information at: http://pypln.org/.
+#
+# PyPLN is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyPLN is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
+from bson import ObjectId
+from mock import patch
+
+from pypln.backend.celery_task import DocumentNotFound, PyPLNTask
+from pypln.backend.pipeline import (FusedPipeline, DependencyGraph,
+        DependencyPipeline, CyclicDependency, run_pipeline)
+from pypln.backend.workers import (Extractor, Tokenizer, FreqDist,
+        Statistics, ElasticIndexer)
+from utils import TaskTest
+
+class FirstStage(PyPLNTask):
+    requires = ['input']
+    provides = ['first']
+
+    def process(self, document):
+        return {'first': document['input'] + ' first'}
+
+class SecondStage(PyPLNTask):
+    requires = ['first']
+    provides = ['second']
+
+    def process(self, document):
+        return {'second': document['first'] + ' second'}
+
+class IndependentStage(PyPLNTask):
+    requires = ['input']
+    provides = ['independent']
+
+    def process(self, document):
+        return {'independent': document['input'] + ' independent'}
+
+class CyclicStage(PyPLNTask):
+    requires = ['second']
+    provides = ['first']
+
+    def process(self, document):
+        return {}
+
+class FailingStage(PyPLNTask):
+    requires = ['input']
+    provides = ['failing']
+
+    def process(self, document):
+        raise ValueError('failing stage')
+
+class AfterFailingStage(PyPLNTask):
+    requires = ['failing']
+    provides = ['after_failing']
+
+    def process(self, document):
+        return {'after_failing': document['failing']}
+
+class FakePipeline(FusedPipeline):
+    stages = [FirstStage, SecondStage]
+
+class FakePipelineWithCheckpoint(FusedPipeline):
+    stages = [FirstStage, SecondStage]
+    checkpoint_every = 1
+
+class TestFusedPipeline(TaskTest):
+    def test_pipeline_should_fetch_only_fields_required_by_its_stages(self):
+        # 'first' is provided by the first stage, so it is not fetched.
+        self.assertEqual(FakePipeline().requires, ['input'])
+
+    def test_stages_should_receive_results_from_previous_stages(self):
+        doc_id = self.collection.insert({'input': 'input'}, w=1)
+
+        FakePipeline().delay(doc_id)
+
+        refreshed_doc = self.collection.find_one({'_id': doc_id})
+        self.assertEqual(refreshed_doc['first'], 'input first')
+        self.assertEqual(refreshed_doc['second'], 'input first second')
+
+    def test_pipeline_with_checkpoints_should_save_all_results(self):
+        doc_id = self.collection.insert({'input': 'input'}, w=1)
+
+        FakePipelineWithCheckpoint().delay(doc_id)
+
+        refreshed_doc = self.collection.find_one({'_id': doc_id})
+        self.assertEqual(refreshed_doc['first'], 'input first')
+        self.assertEqual(refreshed_doc['second'], 'input first second')
+
+class TestDependencyGraph(TaskTest):
+    def test_graph_should_be_built_from_requires_and_provides(self):
+        graph = DependencyGraph([FirstStage, SecondStage, IndependentStage])
+        self.assertEqual(graph.dependencies, {FirstStage.name: set(),
+            SecondStage.name: set([FirstStage.name]),
+            IndependentStage.name: set()})
+        self.assertEqual(graph.ready([]),
+                set([FirstStage.name, IndependentStage.name]))
+        self.assertEqual(graph.ready([FirstStage.name]),
+                set([SecondStage.name, IndependentStage.name]))
+
+    def test_cyclic_dependencies_should_raise_an_exception(self):
+        with self.assertRaises(CyclicDependency):
+            DependencyGraph([FirstStage, SecondStage, CyclicStage])
+
+    def test_default_graph_should_use_exported_workers(self):
+        graph = DependencyGraph()
+        self.assertEqual(graph.dependencies[Extractor.name], set())
+        self.assertEqual(graph.dependencies[Tokenizer.name],
+                set([Extractor.name]))
+        self.assertEqual(graph.dependencies[Statistics.name],
+                set([Tokenizer.name, FreqDist.name]))
+        # ElasticIndexer needs the whole document, so it runs last.
+        self.assertEqual(graph.dependencies[ElasticIndexer.name],
+                set(graph.dependencies) - set([ElasticIndexer.name]))
+
+    def test_pipeline_should_run_all_workers_following_dependencies(self):
+        doc_id = self.collection.insert({'input': 'input'}, w=1)
+
+        run_pipeline(doc_id, [FirstStage, SecondStage, IndependentStage])
+
+        refreshed_doc = self.collection.find_one({'_id': doc_id})
+        self.assertEqual(refreshed_doc['first'], 'input first')
+        self.assertEqual(refreshed_doc['second'], 'input first second')
+        self.assertEqual(refreshed_doc['independent'], 'input independent')
+        self.assertEqual(set(refreshed_doc['pipeline_completed']),
+                set([FirstStage.name, SecondStage.name, IndependentStage.name]))
+
+    def test_pipeline_should_record_failed_workers(self):
+        doc_id = self.collection.insert({'input': 'input'}, w=1)
+
+        run_pipeline(doc_id, [FirstStage, FailingStage, AfterFailingStage])
+
+        refreshed_doc = self.collection.find_one({'_id': doc_id})
+        self.assertEqual(refreshed_doc['first'], 'input first')
+        self.assertEqual(refreshed_doc['pipeline_failed'],
+                [FailingStage.name])
+        self.assertNotIn('after_failing', refreshed_doc)
+
+    def test_running_again_should_clear_previous_failures(self):
+        doc_id = self.collection.insert({'input': 'input'}, w=1)
+        run_pipeline(doc_id, [FirstStage, FailingStage])
+
+        with patch.object(FailingStage, 'process',
+                return_value={'failing': 'fixed'}):
+            run_pipeline(doc_id, [FirstStage, FailingStage])
+
+        refreshed_doc = self.collection.find_one({'_id': doc_id})
+        self.assertEqual(refreshed_doc['failing'], 'fixed')
+        self.assertNotIn('pipeline_failed', refreshed_doc)
+
+    def test_callback_for_a_missing_document_should_retry(self):
+        with patch.object(DependencyPipeline, 'retry',
+                side_effect=RuntimeError) as retry:
+            with self.assertRaises(RuntimeError):
+                DependencyPipeline().run(ObjectId(), [FirstStage.name],
+                        FirstStage.name)
+        self.assertIsInstance(retry.call_args[1]['exc'], DocumentNotFound)
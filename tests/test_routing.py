@@ -0,0 +1,60 @@
+# coding: utf-8
+#
+# Copyright 2015 NAMD-EMAP-FGV
+#
+# This file is part of PyPLN. You can get more information at: http://pypln.org/.
+#
+# PyPLN is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyPLN is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
+import unittest
+
+from mock import patch
+
+from pypln.backend import config, routing
+from pypln.backend.workers import __all__ as exported_workers
+
+
+class TestRouting(unittest.TestCase):
+    def test_every_exported_worker_should_have_a_resource_class(self):
+        for worker_name in exported_workers:
+            self.assertIn(config.WORKER_RESOURCE_CLASSES[worker_name],
+                    config.RESOURCE_CLASS_CONCURRENCY)
+
+    def test_worker_tasks_should_be_routed_to_their_own_queue(self):
+        route = routing.WorkerRouter().route_for_task(
+                'pypln.backend.workers.tokenizer.Tokenizer')
+        self.assertEqual(route['queue'], 'pypln.Tokenizer')
+
+    def test_other_tasks_should_use_the_default_queue(self):
+        router = routing.WorkerRouter()
+        self.assertIsNone(router.route_for_task(
+            'pypln.backend.pipeline.DependencyPipeline'))
+        self.assertIsNone(router.route_for_task(
+            'pypln.backend.workers.unknown.Unknown'))
+
+    def test_there_should_be_one_queue_per_worker(self):
+        queue_names = [queue.name for queue in routing.worker_queues()]
+        self.assertEqual(sorted(queue_names),
+                sorted(routing.queue_name(worker_name)
+                    for worker_name in config.WORKER_RESOURCE_CLASSES))
+
+    def test_worker_command_should_consume_queues_of_resource_class(self):
+        resource_classes = {'Extractor': 'subprocess',
+                'PalavrasRaw': 'subprocess', 'Tokenizer': 'cpu-heavy'}
+        concurrency = {'subprocess': 3, 'cpu-heavy': 2}
+        with patch.object(config, 'WORKER_RESOURCE_CLASSES',
+                resource_classes), patch.object(config,
+                        'RESOURCE_CLASS_CONCURRENCY', concurrency):
+            command = routing.worker_command('subprocess')
+        self.assertIn('-Q pypln.Extractor,pypln.PalavrasRaw ', command)
+        self.assertTrue(command.endswith('--concurrency=3'))
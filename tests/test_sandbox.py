@@ -0,0 +1,72 @@
+# coding: utf-8
+#
+# Copyright 2015 NAMD-EMAP-FGV
+#
+# This file is part of PyPLN. You can get more information at: http://pypln.org/.
+#
+# PyPLN is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyPLN is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
+import sys
+import unittest
+from tempfile import NamedTemporaryFile
+
+from pypln.backend import sandbox
+
+
+class TestSandbox(unittest.TestCase):
+    def test_should_return_outputs_of_the_program(self):
+        self.assertEqual(sandbox.run(['cat'], 'input', timeout=10),
+                ('input', ''))
+
+    def test_program_should_run_in_a_process_group_of_its_own(self):
+        output, _ = sandbox.run([sys.executable, '-c',
+            'import os; print os.getpgrp() == os.getpid()'], timeout=10)
+        self.assertEqual(output.strip(), 'True')
+
+    def test_program_should_be_stopped_after_timeout(self):
+        with self.assertRaises(sandbox.LimitExceeded) as context:
+            sandbox.run(['sleep', '10'], timeout=1)
+        self.assertEqual(context.exception.reason, 'timeout')
+        self.assertEqual(context.exception.as_marker(),
+                {'command': 'sleep', 'reason': 'timeout', 'detail': ''})
+
+    def test_program_should_be_stopped_after_cpu_time(self):
+        with self.assertRaises(sandbox.LimitExceeded) as context:
+            sandbox.run(['sh', '-c', 'while :; do :; done'], cpu_time=1,
+                    timeout=10)
+        self.assertEqual(context.exception.reason, 'cpu_time')
+
+    def test_program_should_be_stopped_when_output_is_too_large(self):
+        with self.assertRaises(sandbox.LimitExceeded) as context:
+            sandbox.run(['yes'], max_output=1024, timeout=10)
+        self.assertEqual(context.exception.reason, 'output_size')
+
+    def test_program_should_be_stopped_when_a_file_is_too_large(self):
+        with NamedTemporaryFile() as output:
+            with self.assertRaises(sandbox.LimitExceeded) as context:
+                sandbox.run(['sh', '-c', 'exec yes > ' + output.name],
+                        max_output=1024, timeout=10)
+            self.assertEqual(context.exception.reason, 'file_size')
+
+    def test_code_in_the_process_should_be_stopped_after_timeout(self):
+        with self.assertRaises(sandbox.LimitExceeded) as context:
+            with sandbox.time_limit(0.1, 'loop'):
+                while True:
+                    pass
+        self.assertEqual(context.exception.as_marker(),
+                {'command': 'loop', 'reason': 'timeout', 'detail': ''})
+
+    def test_time_limit_should_not_stop_code_that_finishes_in_time(self):
+        with sandbox.time_limit(10, 'sum'):
+            total = sum(range(10))
+        self.assertEqual(total, 45)
@@ -0,0 +1,59 @@
+# coding: utf-8
+#
+# Copyright 2015 NAMD-EMAP-FGV
+#
+# This file is part of PyPLN. You can get more information at: http://pypln.org/.
+#
+# PyPLN is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyPLN is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
+import unittest
+
+from pypln.backend.packing import unpack_ints
+from pypln.backend.tokens import (compact_tokens, document_sentences,
+        document_tokens)
+
+
+class TestCompactTokens(unittest.TestCase):
+    sentences = [[u'this', u'is', u'a', u'test', u'.'],
+                 [u'this', u'is', u'another', u'!']]
+
+    def test_tokens_should_be_stored_as_ids_in_a_vocabulary(self):
+        document = compact_tokens(self.sentences)
+        self.assertEqual(document['tokens'], None)
+        self.assertEqual(document['sentences'], None)
+        self.assertEqual(document['vocabulary'], [u'this', u'is', u'a',
+            u'test', u'.', u'another', u'!'])
+        self.assertEqual(unpack_ints(document['token_ids']),
+                [0, 1, 2, 3, 4, 0, 1, 5, 6])
+        self.assertEqual(unpack_ints(document['sentence_offsets']),
+                [0, 5, 9])
+
+    def test_accessors_should_give_back_tokens_and_sentences(self):
+        document = compact_tokens(self.sentences)
+        self.assertEqual(document_tokens(document),
+                self.sentences[0] + self.sentences[1])
+        self.assertEqual(document_sentences(document), self.sentences)
+        self.assertEqual(document_sentences(document, materialize=False),
+                [[0, 1, 2, 3, 4], [0, 1, 5, 6]])
+
+    def test_accessors_should_read_documents_that_are_not_compact(self):
+        document = {'tokens': self.sentences[0] + self.sentences[1],
+                    'sentences': self.sentences}
+        self.assertEqual(document_tokens(document, materialize=False),
+                document['tokens'])
+        self.assertEqual(document_sentences(document), self.sentences)
+
+    def test_empty_document_should_have_no_sentences(self):
+        document = compact_tokens([])
+        self.assertEqual(document_tokens(document), [])
+        self.assertEqual(document_sentences(document), [])
@@ -0,0 +1,43 @@
+# coding: utf-8
+#
+# Copyright 2015 NAMD-EMAP-FGV
+#
+# This file is part of PyPLN. You can get more information at: http://pypln.org/.
+#
+# PyPLN is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyPLN is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
+import hashlib
+
+from pypln.backend import config
+from pypln.backend.uploads import get_upload_store, open_upload, store_upload
+from utils import TaskTest
+
+
+class TestUploads(TaskTest):
+    def tearDown(self):
+        super(TestUploads, self).tearDown()
+        uploads = self.db[config.MONGODB_UPLOADS_COLLECTION]
+        uploads.files.remove({})
+        uploads.chunks.remove({})
+
+    def test_upload_should_be_stored_by_digest(self):
+        contents = 'This is a test file.'
+        digest = store_upload(contents, 'test.txt')
+        self.assertEqual(digest, hashlib.sha256(contents).hexdigest())
+        self.assertEqual(open_upload(digest).read(), contents)
+
+    def test_duplicate_upload_should_be_stored_once(self):
+        first_digest = store_upload('This is a test file.', 'first.txt')
+        second_digest = store_upload('This is a test file.', 'second.txt')
+        self.assertEqual(first_digest, second_digest)
+        self.assertEqual(get_upload_store().find().count(), 1)
@@ -0,0 +1,51 @@
+# coding: utf-8
+#
+# Copyright 2015 NAMD-EMAP-FGV
+#
+# This file is part of PyPLN. You can get more information at: http://pypln.org/.
+#
+# PyPLN is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyPLN is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
+import unittest
+
+from mock import Mock, patch
+
+from pypln.backend import warmup
+
+
+class TestWarmUp(unittest.TestCase):
+    def test_warm_up_should_report_load_time_of_each_model(self):
+        load_times = warmup.warm_up(['Extractor', 'Tokenizer', 'POS',
+            'WordCloud', 'SpellingChecker'])
+        self.assertEqual(set(load_times), set(model[0] for model in
+            warmup.MODELS))
+
+    def test_warm_up_should_load_only_models_used_by_given_workers(self):
+        load_times = warmup.warm_up(['Tokenizer', 'Extractor', 'FreqDist'])
+        self.assertEqual(set(load_times), set(['punkt', 'magic database']))
+
+    def test_models_that_fail_to_load_should_be_skipped(self):
+        def fail():
+            raise LookupError('Resource not found')
+        with patch.object(warmup, 'MODELS', [('broken', ['Tokenizer'],
+                fail)]):
+            self.assertEqual(warmup.warm_up(['Tokenizer']), {})
+
+    def test_default_warm_up_should_load_the_spellchecker_dictionaries(self):
+        models = [(name, used_by, Mock()) for name, used_by, load in
+                warmup.MODELS]
+        with patch.object(warmup, 'MODELS', models):
+            load_times = warmup.warm_up()
+        self.assertIn('spellchecker dictionaries', load_times)
+        for name, used_by, load in models:
+            load.assert_called_once_with()
@@ -19,8 +19,24 @@
 
 import base64
 import os
+import random
+import re
+import time
+import unittest
+from shutil import rmtree
+from tempfile import mkdtemp
 from textwrap import dedent
-from pypln.backend.workers import Extractor
+from HTMLParser import HTMLParser
+from mock import patch
+from pypln.backend import config, sandbox
+from pypln.backend.texts import document_text, get_text_store
+from pypln.backend.uploads import get_upload_store, store_upload
+from pypln.backend.workers import Extractor, extractor
+from pypln.backend.workers.extractor import (ExtractorBackend,
+        HTMLTextExtractor, LanguageSampler, TextStream, UnsupportedUpload,
+        clean, encoding_candidates, extract_pdf, extract_pdf_in_process,
+        extract_upload, get_backends, language_sample, page_ranges,
+        parse_html, sniff_prefix, strip_html_head, trial_decode)
 from utils import TaskTest
 
 DATA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), 'data'))
@@ -36,6 +52,63 @@ class TestExtractorWorker(TaskTest):
         self.assertEqual(refreshed_document['text'], expected)
         self.assertEqual(refreshed_document['file_metadata'], {})
         self.assertEqual(refreshed_document['mimetype'], 'text/plain')
+        self.assertEqual(refreshed_document['scratch_bytes_written'], 0)
+
+    def test_extraction_from_stored_upload(self):
+        expected = "This is a test file.\nI'm testing PyPLN extractor worker!"
+        filename = os.path.join(DATA_DIR, 'test.txt')
+        digest = store_upload(open(filename).read(), filename)
+        doc_id = self.collection.insert({'filename': filename,
+            'contents_digest': digest}, w=1)
+        try:
+            Extractor().delay(doc_id)
+        finally:
+            get_upload_store().delete(digest)
+        refreshed_document = self.collection.find_one({'_id': doc_id})
+        self.assertEqual(refreshed_document['text'], expected)
+        self.assertEqual(refreshed_document['mimetype'], 'text/plain')
+
+    def test_large_upload_should_be_extracted_to_gridfs(self):
+        filename = os.path.join(DATA_DIR, 'test.html')
+        expected = "This is a test file. I'm testing PyPLN extractor worker!"
+        digest = store_upload(open(filename).read(), filename)
+        doc_id = self.collection.insert({'filename': filename,
+            'contents_digest': digest}, w=1)
+        try:
+            with patch.object(config, 'STREAMING_EXTRACTION_MIN_SIZE', 1), \
+                    patch.object(config, 'STREAMING_CHUNK_SIZE', 16):
+                Extractor().delay(doc_id)
+        finally:
+            get_upload_store().delete(digest)
+        refreshed_document = self.collection.find_one({'_id': doc_id})
+        try:
+            self.assertEqual(refreshed_document['text'], None)
+            self.assertEqual(document_text(refreshed_document), expected)
+            self.assertEqual(refreshed_document['mimetype'], 'text/html')
+        finally:
+            get_text_store().delete(refreshed_document['text_file_id'])
+
+    def test_uploads_should_be_streamed_from_the_minimum_size(self):
+        filename = os.path.join(DATA_DIR, 'test.txt')
+        contents = open(filename).read()
+        digest = store_upload(contents, filename)
+        self.addCleanup(get_upload_store().delete, digest)
+        for min_size, streamed in ((len(contents), True),
+                (len(contents) + 1, False)):
+            doc_id = self.collection.insert({'filename': filename,
+                'contents_digest': digest}, w=1)
+            with patch.object(config, 'STREAMING_EXTRACTION_MIN_SIZE',
+                    min_size):
+                Extractor().delay(doc_id)
+            refreshed_document = self.collection.find_one({'_id': doc_id})
+            if refreshed_document['text_file_id'] is not None:
+                self.addCleanup(get_text_store().delete,
+                        refreshed_document['text_file_id'])
+            self.assertEqual(refreshed_document['text'] is None, streamed)
+
+    def test_default_streaming_size_should_keep_texts_below_16mb(self):
+        self.assertLess(2 * config.STREAMING_EXTRACTION_MIN_SIZE,
+                16 * 1024 * 1024)
 
     def test_extraction_from_html_file(self):
         expected = "This is a test file. I'm testing PyPLN extractor worker!"
@@ -87,6 +160,81 @@ class TestExtractorWorker(TaskTest):
                          "Items missing or with different values: {}").format(
                          u", ".join(unicode(item) for item in diff_set)))
         self.assertEqual(refreshed_document['mimetype'], 'application/pdf')
+        self.assertGreater(refreshed_document['scratch_bytes_written'], 0)
+
+    def test_pdf_without_text_for_pypdf2_should_go_to_pdftohtml(self):
+        # PyPDF2 can't find the text in this PDF (or is not installed).
+        expected = "This is a test file.\nI'm testing PyPLN extractor worker!"
+        filename = os.path.join(DATA_DIR, 'test.pdf')
+        doc_id = self.collection.insert({'filename': filename,
+            'contents': base64.b64encode(open(filename).read())}, w=1)
+        with patch.object(config, 'EXTRACTOR_BACKENDS',
+                ['pypdf2', 'pdftohtml']):
+            Extractor().delay(doc_id)
+        refreshed_document = self.collection.find_one({'_id': doc_id})
+        self.assertEqual(refreshed_document['text'], expected)
+        self.assertEqual(refreshed_document['file_metadata']['Pages'], '1')
+
+    def test_duplicate_upload_should_use_the_extractor_cache(self):
+        cache_collection = 'test_extractor_cache'
+        self.addCleanup(self.db[cache_collection].drop)
+        contents = base64.b64encode(open(os.path.join(DATA_DIR,
+            'test.html')).read())
+        first_id = self.collection.insert({'contents': contents}, w=1)
+        duplicate_id = self.collection.insert({'contents': contents}, w=1)
+        with patch.object(config, 'EXTRACTOR_CACHE_MAX_ENTRIES', 10), \
+                patch.object(config, 'MONGODB_EXTRACTOR_CACHE_COLLECTION',
+                        cache_collection):
+            Extractor().delay(first_id)
+            Extractor().delay(duplicate_id)
+            stats = Extractor().get_result_cache().stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        first_document = self.collection.find_one({'_id': first_id})
+        duplicate_document = self.collection.find_one({'_id': duplicate_id})
+        self.assertEqual(duplicate_document['text'], first_document['text'])
+
+    def test_cached_results_should_not_report_scratch_bytes(self):
+        result = Extractor().from_cache({'text': 'text',
+            'scratch_bytes_written': 1024})
+        self.assertEqual(result, {'text': 'text', 'scratch_bytes_written': 0})
+
+    def test_digest_should_be_fetched_even_without_the_cache(self):
+        with patch.object(config, 'RESULT_CACHE_MAX_ENTRIES', 0), \
+                patch.object(config, 'EXTRACTOR_CACHE_MAX_ENTRIES', 0):
+            self.assertIn('contents_digest', Extractor()._fields_to_fetch())
+
+    def test_extraction_errors_should_not_be_cached(self):
+        self.assertFalse(Extractor().should_cache({'text': '',
+            'extraction_error': {'reason': 'timeout'}}))
+        self.assertTrue(Extractor().should_cache({'text': 'text',
+            'extraction_error': None}))
+
+    def test_pdf_that_hits_a_limit_should_get_an_extraction_error(self):
+        filename = os.path.join(DATA_DIR, 'test.pdf')
+        data = {'filename': filename,
+                'contents': base64.b64encode(open(filename).read())}
+        doc_id = self.collection.insert(data, w=1)
+        error = sandbox.LimitExceeded('pdftohtml', 'timeout')
+        with patch.object(sandbox, 'run', side_effect=error):
+            Extractor().delay(doc_id)
+        refreshed_document = self.collection.find_one({'_id': doc_id})
+        self.assertEqual(refreshed_document['text'], '')
+        self.assertEqual(refreshed_document['mimetype'], 'application/pdf')
+        self.assertEqual(refreshed_document['extraction_error'],
+                {'command': 'pdftohtml', 'reason': 'timeout', 'detail': ''})
+
+    def test_pdf_extraction_should_remove_its_scratch_directory(self):
+        filename = os.path.join(DATA_DIR, 'test.pdf')
+        data = {'filename': filename,
+                'contents': base64.b64encode(open(filename).read())}
+        doc_id = self.collection.insert(data, w=1)
+        scratch_dir = mkdtemp()
+        try:
+            with patch.object(config, 'EXTRACTOR_SCRATCH_DIR', scratch_dir):
+                Extractor().delay(doc_id)
+            self.assertEqual(os.listdir(scratch_dir), [])
+        finally:
+            rmtree(scratch_dir)
 
     def test_extraction_from_html(self):
         contents = dedent('''
@@ -222,3 +370,268 @@ class TestExtractorWorker(TaskTest):
         self.assertEqual(refreshed_document['text'], expected)
         self.assertEqual(refreshed_document['file_metadata'], {})
         self.assertEqual(refreshed_document['language'], 'en')
+
+
+class TestParseHtml(unittest.TestCase):
+    html = dedent('''
+        <html><head><title>Testing</title>
+        <script>document.write("<div>must not appear</div>");</script>
+        <!-- a <b>comment</b> -->
+        </head><body><h1>Title</h1>text <span>with</span> tags<br>
+        <style>p { color: red; }</style>end</body></html>
+        ''')
+
+    def test_should_remove_tags_comments_scripts_and_styles(self):
+        self.assertEqual(clean(parse_html(self.html, True,
+            ['script', 'style'])), 'Testing\n\nTitle\n\ntext with tags\n\nend')
+
+    def test_should_give_the_same_text_when_fed_in_chunks(self):
+        expected = clean(parse_html(self.html, True, ['script', 'style']))
+        for chunk_size in (1, 2, 3, 7):
+            parser = HTMLTextExtractor(True, ['script', 'style'])
+            for start in range(0, len(self.html), chunk_size):
+                parser.feed(self.html[start:start + chunk_size])
+            self.assertEqual(clean(parser.close()), expected)
+
+    def test_unclosed_script_should_be_removed_up_to_the_end(self):
+        self.assertEqual(clean(parse_html('text<script>var a = 1;', True,
+            ['script'])), 'text')
+
+    def test_unclosed_comment_should_be_kept(self):
+        self.assertEqual(parse_html('text <!-- comment'), 'text <!-- comment')
+
+
+def legacy_clean(text):
+    # The implementation `clean` replaced, with one pass for each rule.
+    text = re.sub('([\n]+)[ \t]*', r'\1', text)
+    text = re.sub('[ \t]*\n', '\n', text)
+    text = re.sub('[\n]{3,}', '\n\n', text)
+    text = re.sub('[ \t]{2,}', ' ', text)
+    text = re.sub('[ \t]*([' + re.escape('!,.:;?') + '])', r'\1', text)
+    return text.strip()
+
+class TestClean(unittest.TestCase):
+    def test_should_normalize_whitespace(self):
+        self.assertEqual(clean(u'  a  b \t\n \n\n\tc , d\t.\n e\t\tf\n'),
+                u'a b\n\nc, d.\ne f')
+
+    def test_should_give_the_same_result_as_legacy_implementation(self):
+        alphabet = [' ', '  ', '\t', '\n', '\n\n', '\r', 'a', 'bc', '.',
+                    ',', '!', '?', ':', ';', u'\xe1', u'\xa0']
+        random_generator = random.Random(42)
+        for _ in range(5000):
+            text = u''.join(random_generator.choice(alphabet)
+                    for _ in range(random_generator.randint(0, 30)))
+            self.assertEqual(clean(text), legacy_clean(text))
+            self.assertEqual(clean(text.encode('utf-8')),
+                    legacy_clean(text.encode('utf-8')))
+
+
+def unsupported(data):
+    raise UnsupportedUpload('unsupported')
+
+def endless(data):
+    while True:
+        pass
+
+class TestExtractorBackends(unittest.TestCase):
+    def setUp(self):
+        test_backends = {
+            'first': ExtractorBackend('first', ['text/x-test'],
+                lambda data: ('first', {}, 0)),
+            'second': ExtractorBackend('second', ['text/x-test'],
+                lambda data: ('second', {}, 0)),
+            'unsupported': ExtractorBackend('unsupported', ['text/x-test'],
+                unsupported),
+            'endless': ExtractorBackend('endless', ['text/x-test'], endless),
+        }
+        patcher = patch.dict(extractor.backends, test_backends)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_backends_should_be_tried_in_the_configured_order(self):
+        with patch.object(config, 'EXTRACTOR_BACKENDS',
+                ['second', 'html', 'first']):
+            self.assertEqual([backend.name for backend in
+                get_backends('text/x-test')], ['second', 'first'])
+            self.assertEqual(extract_upload('text/x-test', 'data'),
+                    ('second', {}, 0))
+        self.assertEqual(extract_upload('text/x-unknown', 'data'), None)
+
+    def test_unsupported_upload_should_go_to_the_next_backend(self):
+        with patch.object(config, 'EXTRACTOR_BACKENDS',
+                ['unsupported', 'first']):
+            self.assertEqual(extract_upload('text/x-test', 'data'),
+                    ('first', {}, 0))
+
+    def test_upload_bigger_than_max_size_should_go_to_the_next_backend(self):
+        with patch.object(config, 'EXTRACTOR_BACKENDS', ['first', 'second']), \
+                patch.object(config, 'EXTRACTOR_BACKEND_MAX_SIZES',
+                        {'first': 3}):
+            self.assertEqual(extract_upload('text/x-test', 'abc'),
+                    ('first', {}, 0))
+            self.assertEqual(extract_upload('text/x-test', 'abcd'),
+                    ('second', {}, 0))
+
+    def test_upload_too_big_for_every_backend_should_be_an_error(self):
+        with patch.object(config, 'EXTRACTOR_BACKENDS', ['first']), \
+                patch.object(config, 'EXTRACTOR_BACKEND_MAX_SIZES',
+                        {'first': 3}):
+            with self.assertRaises(sandbox.LimitExceeded) as context:
+                extract_upload('text/x-test', 'abcd')
+        self.assertEqual(context.exception.as_marker(), {'command': 'first',
+            'reason': 'input_size', 'detail': '4 bytes'})
+
+    def test_backend_in_the_process_should_be_stopped_after_timeout(self):
+        with patch.object(config, 'EXTRACTOR_BACKENDS', ['endless']), \
+                patch.object(config, 'EXTRACTOR_BACKEND_TIMEOUTS',
+                        {'endless': 0.1}):
+            with self.assertRaises(sandbox.LimitExceeded) as context:
+                extract_upload('text/x-test', 'data')
+        self.assertEqual(context.exception.reason, 'timeout')
+
+    def test_pypdf2_timeout_should_not_fall_back_to_the_next_backend(self):
+        slow_pdf = ExtractorBackend('slow_pdf', ['text/x-test'],
+                extract_pdf_in_process)
+        with patch.dict(extractor.backends, {'slow_pdf': slow_pdf}), \
+                patch.object(extractor, 'PyPDF2') as pypdf2, \
+                patch.object(config, 'EXTRACTOR_BACKENDS',
+                        ['slow_pdf', 'first']), \
+                patch.object(config, 'EXTRACTOR_BACKEND_TIMEOUTS',
+                        {'slow_pdf': 0.1}):
+            pypdf2.PdfFileReader.side_effect = lambda *args, **kwargs: \
+                    endless(None)
+            with self.assertRaises(sandbox.LimitExceeded) as context:
+                extract_upload('text/x-test', 'data')
+        self.assertEqual(context.exception.reason, 'timeout')
+
+
+class TestTextStream(unittest.TestCase):
+    def test_should_give_the_same_text_as_the_whole_upload(self):
+        alphabet = [u'a', u'bc', u' ', u'  ', u'\n', u'\t', u'.', u',',
+                    u'&amp;', u'&#233;', u'&lt', u'&', u'\xe9', u'<p>',
+                    u'<br>', u'<div>', u'<script>x</script>', u'<!-- c -->']
+        random_generator = random.Random(42)
+        for _ in range(1000):
+            data = u''.join(random_generator.choice(alphabet)
+                    for _ in range(random_generator.randint(0, 40)))
+            data = data.encode('utf-8')
+            for mime_type in ('text/plain', 'text/html'):
+                text = data
+                if mime_type == 'text/html':
+                    text = parse_html(data, True, ['script', 'style'])
+                expected = clean(HTMLParser().unescape(text.decode('utf-8')))
+                stream = TextStream(mime_type, 'utf-8')
+                pieces = []
+                position = 0
+                while position < len(data):
+                    size = random_generator.randint(1, 7)
+                    pieces.append(stream.feed(data[position:position + size]))
+                    position += size
+                pieces.append(stream.close())
+                self.assertEqual(u''.join(pieces), expected)
+
+    def test_language_sampler_should_sample_evenly_spaced_chunks(self):
+        sampler = LanguageSampler(80, 8)
+        for position in range(0, 80, 10):
+            sampler.add(u'{}{}{}'.format(position, position, position),
+                    position)
+        self.assertEqual(sampler.sample(), u'00\n20\n40\n60')
+
+
+class TestPdfChunks(unittest.TestCase):
+    def test_page_ranges_should_cover_the_pages_after_the_first_chunk(self):
+        self.assertEqual(page_ranges(120, 50), [(51, 100), (101, 120)])
+        self.assertEqual(page_ranges(100, 50), [(51, 100)])
+        self.assertEqual(page_ranges(30, 50), [])
+
+    def test_strip_html_head_should_keep_only_the_body(self):
+        html = ('<HTML><HEAD><TITLE>Title</TITLE></HEAD>\n'
+                '<BODY bgcolor="#A0A0A0">text</BODY></HTML>')
+        self.assertEqual(strip_html_head(html), 'text</BODY></HTML>')
+
+
+class TestPdfFailures(unittest.TestCase):
+    """
+    Runs `extract_pdf` with fake `pdfinfo` and `pdftohtml` programs, which
+    report three pages, so each page is converted by its own `pdftohtml`.
+    """
+
+    def setUp(self):
+        self.bin_dir = mkdtemp()
+        self.addCleanup(rmtree, self.bin_dir)
+        self.scratch_dir = mkdtemp()
+        self.addCleanup(rmtree, self.scratch_dir)
+        self.pids_file = os.path.join(self.bin_dir, 'pids')
+        self.write_program('pdfinfo', 'echo "Pages: 3"')
+        patches = [patch.dict(os.environ,
+                        {'PATH': self.bin_dir + ':' + os.environ['PATH']}),
+                   patch.object(config, 'EXTRACTOR_SCRATCH_DIR',
+                       self.scratch_dir),
+                   patch.object(config, 'EXTRACTOR_TIMEOUT', 60),
+                   patch.object(config, 'PDF_PAGES_PER_CHUNK', 1),
+                   patch.object(config, 'PDF_MAX_PARALLEL_CHUNKS', 3)]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def write_program(self, name, script):
+        filename = os.path.join(self.bin_dir, name)
+        with open(filename, 'w') as program:
+            program.write('#!/bin/sh\n' + script + '\n')
+        os.chmod(filename, 0755)
+
+    def test_failed_chunk_should_stop_the_other_chunks(self):
+        # The first chunk crashes after a second; the others would run for
+        # a minute, writing to the scratch directory.
+        self.write_program('pdftohtml', dedent("""
+            for output; do :; done
+            touch "$output.tmp"
+            if [ "$3" = -f ]; then
+                echo $$ >> {}
+                exec sleep 60
+            fi
+            sleep 1
+            kill -9 $$""".format(self.pids_file)))
+        start = time.time()
+        with self.assertRaises(sandbox.LimitExceeded) as context:
+            extract_pdf('%PDF')
+        self.assertLess(time.time() - start, 30)
+        self.assertEqual(context.exception.reason, 'crashed')
+        for pid in open(self.pids_file).read().split():
+            with self.assertRaises(OSError):
+                os.kill(int(pid), 0)
+        self.assertEqual(os.listdir(self.scratch_dir), [])
+
+    def test_failing_pdftohtml_should_leave_no_scratch_files(self):
+        self.write_program('pdftohtml',
+                'for output; do :; done; touch "$output.tmp"; kill -9 $$')
+        with self.assertRaises(sandbox.LimitExceeded) as context:
+            extract_pdf('%PDF')
+        self.assertEqual(context.exception.reason, 'crashed')
+        self.assertEqual(os.listdir(self.scratch_dir), [])
+
+
+class TestDetection(unittest.TestCase):
+    def test_sniff_prefix_should_not_split_multibyte_characters(self):
+        data = u'abc\xe1\xe9'.encode('utf-8')
+        self.assertEqual(sniff_prefix(data, 4), 'abc')
+        self.assertEqual(sniff_prefix(data, 5), 'abc')
+        self.assertEqual(sniff_prefix(data, 6), 'abc')
+        self.assertEqual(sniff_prefix(data, 10), data)
+
+    def test_language_sample_should_take_evenly_spaced_slices(self):
+        self.assertEqual(language_sample('aabbccdd', 4), 'a\nb\nc\nd')
+        self.assertEqual(language_sample('abc', 4), 'abc')
+
+    def test_encoding_candidates_should_not_repeat_encodings(self):
+        self.assertEqual(encoding_candidates('UTF8', 'unknown-8bit', 'utf-8',
+            'iso-8859-1'), ['utf-8', 'iso8859-1'])
+
+    def test_encoding_should_be_detected_beyond_the_sniffed_prefix(self):
+        text = u'ascii only ' * 10 + u'Fl\xe1vio'
+        with patch.object(config, 'EXTRACTOR_SNIFF_SIZE', 20):
+            self.assertEqual(trial_decode(text.encode('utf-8')),
+                    (text, False))
+            self.assertEqual(trial_decode(text.encode('iso-8859-1')),
+                    (text, False))
@@ -16,7 +16,14 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
+import unittest
+
+from mock import patch
+
+from pypln.backend import config
+from pypln.backend.tokens import compact_tokens
 from pypln.backend.workers import FreqDist
+from pypln.backend.workers.freqdist import frequency_distribution
 from utils import TaskTest
 
 
@@ -25,8 +32,9 @@ class TestFreqDistWorker(TaskTest):
         tokens = [u'The', u'sky', u'is', u'blue', u',', u'the', u'sun', u'is',
                   u'yellow', u'.']
 
-        expected_fd =  [[u'is', 2], [u'the', 2], [u'blue', 1], [u'sun', 1],
-                [u'sky', 1], [u',', 1], [u'yellow', 1], [u'.', 1]]
+        # Tokens with the same frequency are in the order they first appear.
+        expected_fd =  [[u'the', 2], [u'is', 2], [u'sky', 1], [u'blue', 1],
+                [u',', 1], [u'sun', 1], [u'yellow', 1], [u'.', 1]]
 
 
         # This is just preparing the expected input in the database
@@ -37,3 +45,45 @@ class TestFreqDistWorker(TaskTest):
         resulting_fd = self.collection.find_one({'_id': doc_id})['freqdist']
 
         self.assertEqual(resulting_fd, expected_fd)
+
+    def test_freqdist_should_count_compact_tokens(self):
+        doc = compact_tokens([[u'The', u'sky', u'is', u'blue', u','],
+            [u'the', u'sun', u'is', u'yellow', u'.']])
+        doc_id = self.collection.insert(doc, w=1)
+        with patch.object(config, 'FREQDIST_TOP_K', 3):
+            FreqDist().delay(doc_id)
+
+        resulting_fd = self.collection.find_one({'_id': doc_id})['freqdist']
+        self.assertEqual(resulting_fd, [[u'the', 2], [u'is', 2],
+            [u'sky', 1]])
+
+    def test_cutoff_settings_should_change_the_fingerprint(self):
+        document = compact_tokens([[u'The', u'sky', u'is', u'blue']])
+        fingerprint = FreqDist().fingerprint(document)
+        with patch.object(config, 'FREQDIST_TOP_K', 3):
+            self.assertNotEqual(FreqDist().fingerprint(document), fingerprint)
+        with patch.object(config, 'FREQDIST_MIN_COUNT', 2):
+            self.assertNotEqual(FreqDist().fingerprint(document), fingerprint)
+
+
+class TestFrequencyDistribution(unittest.TestCase):
+    tokens = list('abcbcdcdde')
+
+    def test_ties_should_be_in_the_order_tokens_first_appear(self):
+        self.assertEqual(frequency_distribution(self.tokens),
+                [('c', 3), ('d', 3), ('b', 2), ('a', 1), ('e', 1)])
+
+    def test_top_k_should_keep_the_most_frequent_tokens(self):
+        self.assertEqual(frequency_distribution(self.tokens, top_k=3),
+                [('c', 3), ('d', 3), ('b', 2)])
+        self.assertEqual(frequency_distribution(self.tokens, top_k=10),
+                frequency_distribution(self.tokens))
+
+    def test_min_count_should_leave_out_rare_tokens(self):
+        self.assertEqual(frequency_distribution(self.tokens, min_count=2),
+                [('c', 3), ('d', 3), ('b', 2)])
+        self.assertEqual(frequency_distribution(self.tokens, top_k=1,
+            min_count=2), [('c', 3)])
+
+    def test_no_tokens_should_give_an_empty_distribution(self):
+        self.assertEqual(frequency_distribution([], top_k=3), [])
@@ -20,6 +20,8 @@
 from unittest import skipIf
 
 from textwrap import dedent
+from mock import patch
+from pypln.backend.packing import pack_spans
 from pypln.backend.workers.palavras_raw import palavras_installed
 from pypln.backend.workers import POS
 from utils import TaskTest
@@ -41,6 +43,32 @@ class TestPosWorker(TaskTest):
         self.assertEqual(refreshed_document['pos'], expected)
         self.assertEqual(refreshed_document['tagset'], 'en-nltk')
 
+    def test_offsets_should_be_taken_from_the_token_spans(self):
+        # `put_offset` can't find the quotes the tokenizer changed.
+        text = u'Say "yes" now.'
+        tokens = [u'Say', u'``', u'yes', u"''", u'now', u'.']
+        token_spans = [(0, 3), (4, 5), (5, 8), (8, 9), (10, 13), (13, 14)]
+        doc_id = self.collection.insert({'text': text, 'tokens': tokens,
+            'token_spans': pack_spans(token_spans), 'language': 'en'}, w=1)
+        POS().delay(doc_id)
+        refreshed_document = self.collection.find_one({'_id': doc_id})
+        self.assertEqual([offset for token, classification, offset in
+            refreshed_document['pos']], [0, 4, 5, 8, 10, 13])
+
+    def test_text_should_not_be_fetched_when_spans_are_used(self):
+        tokens = [u'The', u'sky', u'is', u'blue', u'.']
+        token_spans = [(0, 3), (4, 7), (8, 10), (11, 15), (15, 16)]
+        doc_id = self.collection.insert({'text': u'The sky is blue.',
+            'tokens': tokens, 'token_spans': pack_spans(token_spans),
+            'language': 'en'}, w=1)
+        with patch('pypln.backend.workers.pos.get_document_collection') as \
+                get_document_collection:
+            POS().delay(doc_id)
+        self.assertFalse(get_document_collection.called)
+        refreshed_document = self.collection.find_one({'_id': doc_id})
+        self.assertEqual([offset for token, classification, offset in
+            refreshed_document['pos']], [0, 4, 8, 11, 15])
+
     @skipIf(not palavras_installed(), 'palavras software is not installed')
     def test_pos_should_run_pt_palavras_if_text_is_in_portuguese(self):
         text = 'Isso é uma frase em português.'
@@ -17,6 +17,7 @@
 # You should have received a copy of the GNU General Public License
 # along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
 
+from pypln.backend.tokens import compact_tokens
 from pypln.backend.workers import Statistics
 from utils import TaskTest
 
@@ -39,6 +40,18 @@ class TestStatisticsWorker(TaskTest):
         self.assertAlmostEqual(refreshed_document['momentum_4'], 5.2857, places=3)
         self.assertAlmostEqual(refreshed_document['repertoire'], 0.7777, places=3)
 
+    def test_compact_tokens(self):
+        doc = compact_tokens([['this', 'is', 'a', 'test', '.'], ['this', 'is',
+            'another', '!']])
+        doc['freqdist'] = [('this', 2), ('is', 2), ('a', 1), ('test', 1),
+                ('.', 1), ('another', 1), ('!', 1)]
+        doc_id = self.collection.insert(doc, w=1)
+        Statistics().delay(doc_id)
+
+        refreshed_document = self.collection.find_one({'_id': doc_id})
+        self.assertEqual(refreshed_document['average_sentence_length'], 4.5)
+        self.assertEqual(refreshed_document['average_sentence_repertoire'], 1)
+
     def test_zero_division_error(self):
         doc_id = self.collection.insert({'freqdist': [], 'sentences': []}, w=1)
 
@@ -17,7 +17,18 @@
 # You should have received a copy of the GNU General Public License
 # along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
 
+import unittest
+from textwrap import dedent
+
+from mock import patch
+from nltk import word_tokenize
+
+from pypln.backend import config
+from pypln.backend.packing import unpack_spans
+from pypln.backend.tokens import document_sentences, document_tokens
 from pypln.backend.workers import Tokenizer
+from pypln.backend.workers.tokenizer import (align_tokens, paragraph_chunks,
+        tokenize, tokenize_in_parallel)
 from utils import TaskTest
 
 
@@ -39,3 +50,114 @@ class TestTokenizerWorker(TaskTest):
 
         self.assertEqual(tokens, expected_tokens)
         self.assertEqual(sentences, expected_sentences)
+
+    def test_tokens_should_be_the_same_as_tokenizing_the_whole_text(self):
+        # The tokens used to come from `word_tokenize` on the whole text.
+        text = dedent(u'''
+            Mr. Smith paid $3.50 for "two" apples -- didn't he? Yes!
+            The U.S.A. isn't the U.K.; (parentheses) and [brackets]...
+
+            A new paragraph: it's 5 p.m. and we're done. Ol\xe1, voc\xea.
+            ''')
+        doc_id = self.collection.insert({'text': text}, w=1)
+        Tokenizer().delay(doc_id)
+
+        refreshed_document = self.collection.find_one({'_id': doc_id})
+        self.assertEqual(refreshed_document['tokens'], word_tokenize(text))
+        self.assertEqual(refreshed_document['tokens'],
+                [token for sentence in refreshed_document['sentences']
+                    for token in sentence])
+
+    def test_sentences_should_only_be_segmented_once(self):
+        text = u'The sky is blue. The sun is yellow.'
+        with patch('nltk.tokenize.sent_tokenize') as sent_tokenize:
+            sentences, token_spans, sentence_spans = tokenize(text)
+        self.assertFalse(sent_tokenize.called)
+        self.assertEqual(len(sentences), 2)
+
+    def test_tokenizer_should_return_the_spans_of_tokens_and_sentences(self):
+        text = u'He said "hello".  Then he left.'
+        doc_id = self.collection.insert({'text': text}, w=1)
+        Tokenizer().delay(doc_id)
+
+        refreshed_document = self.collection.find_one({'_id': doc_id})
+        token_spans = unpack_spans(refreshed_document['token_spans'])
+        sentence_spans = unpack_spans(refreshed_document['sentence_spans'])
+        self.assertEqual([text[start:end] for start, end in token_spans],
+                [u'He', u'said', u'"', u'hello', u'"', u'.', u'Then', u'he',
+                    u'left', u'.'])
+        self.assertEqual([text[start:end] for start, end in sentence_spans],
+                [u'He said "hello".', u'Then he left.'])
+
+    def test_large_text_should_be_tokenized_by_paragraphs_in_parallel(self):
+        text = u'\n\n'.join([u'The sky is blue. The sun is "yellow".',
+            u'This is another sentence, in another paragraph.',
+            u'A short one.', u'And the last one!'] * 3)
+        sentences, token_spans, sentence_spans = tokenize(text)
+        doc_id = self.collection.insert({'text': text}, w=1)
+        with patch.object(config, 'TOKENIZER_PARALLEL_MIN_SIZE', 1), \
+                patch.object(config, 'TOKENIZER_CHUNK_SIZE', 60), \
+                patch.object(config, 'TOKENIZER_PROCESSES', 2), \
+                patch('pypln.backend.workers.tokenizer.tokenize_in_parallel',
+                        wraps=tokenize_in_parallel) as parallel:
+            Tokenizer().delay(doc_id)
+        self.assertTrue(parallel.called)
+
+        refreshed_document = self.collection.find_one({'_id': doc_id})
+        self.assertEqual(refreshed_document['sentences'], sentences)
+        self.assertEqual(unpack_spans(refreshed_document['token_spans']),
+                token_spans)
+        self.assertEqual(unpack_spans(refreshed_document['sentence_spans']),
+                sentence_spans)
+
+    def test_compact_tokens_should_give_the_same_tokens_and_sentences(self):
+        text = u'The sky is blue, the sun is yellow. The sky is another thing.'
+        doc_id = self.collection.insert({'text': text}, w=1)
+        with patch.object(config, 'COMPACT_TOKENS', True):
+            Tokenizer().delay(doc_id)
+
+        refreshed_document = self.collection.find_one({'_id': doc_id})
+        sentences, token_spans, sentence_spans = tokenize(text)
+        self.assertEqual(refreshed_document['tokens'], None)
+        self.assertEqual(len(refreshed_document['vocabulary']), 11)
+        self.assertEqual(document_sentences(refreshed_document), sentences)
+        self.assertEqual(document_tokens(refreshed_document),
+                [token for sentence in sentences for token in sentence])
+
+    def test_a_single_chunk_should_be_tokenized_without_the_pool(self):
+        text = u'The sky is blue.\n\nThe sun is yellow.'
+        with patch('pypln.backend.workers.tokenizer.get_pool') as get_pool:
+            self.assertEqual(tokenize_in_parallel(text), tokenize(text))
+        self.assertFalse(get_pool.called)
+
+    def test_compact_tokens_setting_should_change_the_fingerprint(self):
+        document = {'text': u'The sky is blue.', 'text_file_id': None}
+        fingerprint = Tokenizer().fingerprint(document)
+        with patch.object(config, 'COMPACT_TOKENS', True):
+            self.assertNotEqual(Tokenizer().fingerprint(document),
+                    fingerprint)
+
+
+class TestParagraphChunks(unittest.TestCase):
+    def test_chunks_should_end_after_a_paragraph_break(self):
+        text = u'aaa\n\nbbb\n\ncccccccccc\n\nd'
+        self.assertEqual(paragraph_chunks(text, 10),
+                [(0, 10), (10, 22), (22, 23)])
+        self.assertEqual(paragraph_chunks(text, 100), [(0, 23)])
+
+
+class TestAlignTokens(unittest.TestCase):
+    def test_quotes_should_be_aligned_to_the_original_characters(self):
+        text = u"a \"b\" ''c'' ``d''"
+        tokens = [u'a', u'``', u'b', u"''", u'``', u'c', u"''", u'``', u'd',
+                u"''"]
+        self.assertEqual(align_tokens(text, tokens), [(0, 1), (2, 3), (3, 4),
+            (4, 5), (6, 8), (8, 9), (9, 11), (12, 14), (14, 15), (15, 17)])
+
+    def test_missing_token_should_get_an_empty_span(self):
+        self.assertEqual(align_tokens(u'a b', [u'a', u'x', u'b']),
+                [(0, 1), (1, 1), (2, 3)])
+
+    def test_tokens_should_only_be_searched_between_start_and_end(self):
+        self.assertEqual(align_tokens(u'a b a b', [u'a', u'b'], 4, 7),
+                [(4, 5), (6, 7)])
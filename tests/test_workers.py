@@ -0,0 +1,66 @@
+# coding: utf-8
+#
+# Copyright 2015 NAMD-EMAP-FGV
+#
+# This file is part of PyPLN. You can get more information at: http://pypln.org/.
+#
+# PyPLN is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyPLN is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PyPLN.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import subprocess
+import sys
+import unittest
+
+from pypln.backend import workers
+
+
+class TestLazyWorkers(unittest.TestCase):
+    def test_all_exported_workers_should_have_a_module(self):
+        self.assertTrue(set(workers.__all__) <= set(workers.WORKER_MODULES))
+
+    def test_loading_a_worker_should_import_its_module(self):
+        Statistics = workers.load_worker('Statistics')
+        self.assertIn('pypln.backend.workers.statistics', sys.modules)
+        self.assertIn('pypln.backend.workers.statistics',
+                workers.import_times)
+        self.assertEqual(Statistics.__name__, 'Statistics')
+        self.assertIs(workers.Statistics, Statistics)
+
+    def test_metadata_should_match_the_worker_classes(self):
+        for name, metadata in workers.WORKER_METADATA.items():
+            worker = workers.load_worker(name)
+            self.assertEqual(workers.WorkerMetadata(worker.requires,
+                worker.provides, worker.version, worker.settings), metadata,
+                name)
+
+    def test_upstream_workers_should_include_indirect_providers(self):
+        self.assertEqual(workers.upstream_workers(['freqdist']),
+                set(['Extractor', 'Tokenizer', 'FreqDist']))
+        self.assertEqual(workers.upstream_workers(['contents']), set())
+
+    def test_extractor_cache_key_should_not_import_other_workers(self):
+        # Run in a new process, since other tests import every worker.
+        imported = subprocess.check_output([sys.executable, '-c',
+            'import sys\n'
+            'from pypln.backend.workers import Extractor\n'
+            'Extractor()._cache_namespace()\n'
+            'print sorted(name for name in sys.modules\n'
+            '    if name.startswith("pypln.backend.workers.") and\n'
+            '    sys.modules[name])'],
+            cwd=os.path.join(os.path.dirname(__file__), os.pardir))
+        self.assertEqual(imported.strip(),
+                "['pypln.backend.workers.extractor']")
+
+    def test_unknown_attributes_should_raise_attribute_error(self):
+        with self.assertRaises(AttributeError):
+            workers.NotAWorker